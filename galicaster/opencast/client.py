@@ -11,12 +11,21 @@
 # or send a letter to Creative Commons, 171 Second Street, Suite 300,
 # San Francisco, California, 94105, USA.
 
+import os
+import hashlib
+import random
 import re
 import json
 import socket
+import struct
+import threading
+import time
+import uuid
+import zlib
 #IDEA use cStringIO to improve performance
 from StringIO import StringIO
 import pycurl
+from bisect import bisect_left
 from collections import OrderedDict
 import urlparse
 import urllib
@@ -34,6 +43,14 @@ SETRECORDINGSTATE_ENDPOINT = 'capture-admin/recordings/{id}'
 SETSTATE_ENDPOINT = 'capture-admin/agents/{hostname}'
 SETCONF_ENDPOINT = 'capture-admin/agents/{hostname}/configuration'
 INGEST_ENDPOINT = 'ingest/addZippedMediaPackage'
+INGEST_CREATE_MP_ENDPOINT = 'ingest/createMediaPackage'
+INGEST_ADD_TRACK_ENDPOINT = 'ingest/addTrack'
+INGEST_ADD_CATALOG_ENDPOINT = 'ingest/addCatalog'
+INGEST_ADD_ATTACHMENT_ENDPOINT = 'ingest/addAttachment'
+INGEST_INGEST_ENDPOINT = 'ingest/ingest'
+UPLOAD_NEWJOB_ENDPOINT = 'upload/newjob'
+UPLOAD_JOB_ENDPOINT = 'upload/job/{job_id}'
+UPLOAD_JOB_STATUS_ENDPOINT = 'upload/job/{job_id}.json'
 ICAL_ENDPOINT = 'recordings/calendars'
 SERIES_ENDPOINT = 'series/series.json'
 SERVICE_REGISTRY_ENDPOINT = 'services/available.json'
@@ -42,16 +59,610 @@ WORKFLOWS_ENDPOINT = 'workflow/definitions.json'
 GET_USER_ENDPOINT = 'users/{user_id}.json'
 GET_PERSONAL_SERIES_ENDPOINT = 'api/series/?filter=textFilter%3A{user_id}{filter}&sort=&limit=1&offset=0'
 CREATE_SERIES_ENDPOINT = 'api/series/'
+LIST_USERS_ENDPOINT = 'users/users.json?limit={limit}&offset={offset}'
+LIST_SERIES_ENDPOINT = 'api/series/?filter={filter}&sort=&limit={limit}&offset={offset}'
 
 SEARCH_SERVICE_TYPE = 'org.opencastproject.search'
 INGEST_SERVICE_TYPE = 'org.opencastproject.ingest'
 
+CURL_POOL_SIZE = 4
+INGEST_CHUNK_SIZE = 8 * 1024 * 1024
+INGEST_STATE_FILE = 'ingest_state.json'
+STREAM_BLOCK_SIZE = 256 * 1024
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP_MANIFEST = 'manifest.xml'
+# Seconds the service registry and the DNS lookups of its hosts are trusted
+SERVICES_TTL = 300
+DNS_TTL = 300
+# Weight of the last ingest in the per node throughput and error averages
+NODE_STATS_ALPHA = 0.3
+# Upper bounds (ms) of the request timing histogram buckets
+TIMING_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 60000)
+# Request phases measured from pycurl getinfo
+TIMING_PHASES = ('dns', 'connect', 'tls', 'ttfb', 'total')
+# Failures worth another attempt: HTTP status codes and cURL errors (couldn't resolve,
+# couldn't connect, timeout, empty reply, send and receive errors)
+RETRY_STATUS_CODES = (408, 429, 500, 502, 503, 504)
+RETRY_CURL_ERRORS = (6, 7, 28, 52, 55, 56)
+# Idempotent endpoints retried by default
+RETRY_ENDPOINTS = (GET_USER_ENDPOINT, GET_PERSONAL_SERIES_ENDPOINT, SERVICE_REGISTRY_ENDPOINT,
+                   SEARCH_ENDPOINT, UPLOAD_JOB_STATUS_ENDPOINT, ME_ENDPOINT, LIST_USERS_ENDPOINT, LIST_SERIES_ENDPOINT)
+# Capture agent and recording state updates waiting to be sent
+OUTBOX_FILE = 'occlient_outbox.json'
+OUTBOX_VERSION = 1
+# Seconds to gather updates into one burst, and the range of waits after a failed flush
+OUTBOX_FLUSH_DELAY = 0.2
+OUTBOX_MIN_RETRY = 2
+OUTBOX_MAX_RETRY = 60
+# Free space is reported in steps of this many bytes, so the configuration only changes when it crosses one
+CONF_FREE_SPACE_BUCKET = 1024 * 1024 * 1024
+# Seconds after which an unchanged configuration is sent again anyway
+CONF_RESEND_INTERVAL = 3600
+# Longest pause (s) of a throttled upload inside a single progress callback
+MAX_THROTTLE_WAIT = 0.5
+
+
+class CurlPool(object):
+    """
+    Pool of reusable cURL handles sharing the DNS and TLS session caches,
+    safe to use from several threads. Keeping the handles alive lets later
+    requests reuse their open connections instead of paying for a new TCP
+    connect and TLS handshake every time. The connection cache itself is not
+    shared: libcurl does not support sharing it between concurrent threads.
+    """
+
+    def __init__(self, size=CURL_POOL_SIZE):
+        self.size = size
+        self.share = pycurl.CurlShare()
+        self.share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_DNS)
+        self.share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_SSL_SESSION)
+        self.__idle = []
+        self.__lock = threading.Lock()
+
+    def acquire(self):
+        with self.__lock:
+            if self.__idle:
+                return self.__idle.pop()
+        c = pycurl.Curl()
+        c.setopt(pycurl.SHARE, self.share)
+        return c
+
+    def release(self, c):
+        """ Reset the handle options (keeping its connections) and put it back in the pool """
+        try:
+            c.reset()
+        except Exception:
+            c.close()
+            return
+
+        try:
+            # older pycurl releases detach the share on reset()
+            c.setopt(pycurl.SHARE, self.share)
+        except pycurl.error:
+            pass # still sharing
+
+        with self.__lock:
+            if len(self.__idle) < self.size:
+                self.__idle.append(c)
+                return
+        c.close()
+
+
+class RetryPolicy(object):
+    """
+    Exponential backoff with full jitter, limited by a retry budget: every
+    request adds budget_ratio to the budget (up to budget_max) and every retry
+    takes one, so a server that is down does not get several times the usual
+    load from the retries.
+    """
+
+    def __init__(self, attempts=3, base_delay=0.2, max_delay=2.0, budget_ratio=0.2, budget_max=10):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget_ratio = budget_ratio
+        self.budget_max = budget_max
+        self.budget = budget_max
+        self.lock = threading.Lock()
+
+    def request(self):
+        with self.lock:
+            self.budget = min(self.budget + self.budget_ratio, self.budget_max)
+
+    def delay(self, attempt):
+        """ Seconds to wait before retrying after the given failed attempt (0 based), None to give up """
+        with self.lock:
+            if attempt + 1 >= self.attempts or self.budget < 1:
+                return None
+            self.budget -= 1
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+def not_found(exc):
+    """ Whether a request failed because the server does not know the resource (any more) """
+    return isinstance(exc, IOError) and getattr(exc, 'status_code', None) == 404
+
+
+def retryable(exc):
+    """ Whether a failed request may succeed if sent again """
+    if isinstance(exc, IOError):
+        return getattr(exc, 'status_code', None) in RETRY_STATUS_CODES
+    cause = exc.args[0] if isinstance(exc, RuntimeError) and exc.args else exc
+    return isinstance(cause, pycurl.error) and bool(cause.args) and cause.args[0] in RETRY_CURL_ERRORS
+
+
+class StateOutbox(object):
+    """
+    Durable queue of the capture agent and recording state updates. Only the
+    latest update for each agent or recording is kept, and a background thread
+    sends them in order, so the callers never wait for the server and updates
+    made during an outage are delivered once it is reachable again.
+    """
+
+    def __init__(self, send, path=None, logger=None):
+        self.send = send
+        self.path = path
+        self.logger = logger
+        self.entries = OrderedDict()
+        self.sequence = 0
+        self.error = None
+        self.condition = threading.Condition()
+        self.__load()
+
+        self.thread = threading.Thread(target=self.run)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def put(self, key, endpoint, path_params, postfield):
+        """ Queue an update, replacing the pending one with the same key """
+        with self.condition:
+            self.sequence += 1
+            self.entries.pop(key, None)
+            self.entries[key] = (self.sequence, endpoint, path_params, postfield)
+            self.__save()
+            self.condition.notify()
+
+    def check(self):
+        """ Raise the error of the last flush, if it failed """
+        error = self.error
+        if error is not None:
+            raise error
+
+    def run(self):
+        wait = OUTBOX_MIN_RETRY
+        while True:
+            with self.condition:
+                while not self.entries:
+                    self.condition.wait()
+            time.sleep(OUTBOX_FLUSH_DELAY)
+            if self.flush():
+                wait = OUTBOX_MIN_RETRY
+            else:
+                with self.condition:
+                    # a new update is tried right away, the queued ones after the wait
+                    self.condition.wait(wait)
+                wait = min(wait * 2, OUTBOX_MAX_RETRY)
+
+    def flush(self):
+        """ Send the queued updates in order, returns False if one failed """
+        with self.condition:
+            pending = self.entries.items()
+        for key, (sequence, endpoint, path_params, postfield) in pending:
+            try:
+                self.send(endpoint, path_params, postfield)
+            except Exception as exc:
+                self.error = exc
+                self.logger and self.logger.warning('{} state updates kept until the server is reachable: {}'.format(
+                    len(self.entries), exc))
+                return False
+            with self.condition:
+                if self.entries.get(key, (None,))[0] == sequence:
+                    del self.entries[key]
+                    self.__save()
+        self.error = None
+        return True
+
+    def __load(self):
+        if not self.path or not os.path.isfile(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            if data.get('version') == OUTBOX_VERSION:
+                for kind, name, endpoint, path_params, postfield in data['entries']:
+                    self.sequence += 1
+                    self.entries[(kind, name)] = (self.sequence, endpoint, path_params, postfield)
+        except (IOError, OSError, ValueError, KeyError) as exc:
+            self.logger and self.logger.warning('Could not load the state outbox {}: {}'.format(self.path, exc))
+
+    def __save(self):
+        if not self.path:
+            return
+        tmp_path = self.path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump({'version': OUTBOX_VERSION,
+                           'entries': [list(key) + [endpoint, path_params, postfield]
+                                       for key, (sequence, endpoint, path_params, postfield) in self.entries.iteritems()]}, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(tmp_path, self.path)
+        except (IOError, OSError) as exc:
+            self.logger and self.logger.warning('Could not save the state outbox {}: {}'.format(self.path, exc))
+
+
+class Histogram(object):
+    """ Counts of values (ms) in the TIMING_BUCKETS, plus the overflow """
+
+    def __init__(self):
+        self.buckets = [0] * (len(TIMING_BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.buckets[bisect_left(TIMING_BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def percentile(self, fraction):
+        """ Upper bound of the bucket holding the given fraction of the values """
+        needed = fraction * self.count
+        seen = 0
+        for bound, count in zip(TIMING_BUCKETS, self.buckets):
+            seen += count
+            if count and seen >= needed:
+                return bound
+        return self.max
+
+    def summary(self):
+        return {'count': self.count,
+                'mean': self.sum / self.count if self.count else 0.0,
+                'max': self.max,
+                'p50': self.percentile(0.5),
+                'p95': self.percentile(0.95),
+                'buckets': zip(TIMING_BUCKETS + (None,), self.buckets)}
+
+
+class RequestStats(object):
+    """ Timing histograms and error counters of the requests, by endpoint """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.endpoints = {}
+
+    def __endpoint(self, endpoint):
+        stats = self.endpoints.get(endpoint)
+        if stats is None:
+            stats = self.endpoints[endpoint] = {
+                'requests': 0, 'errors': {}, 'timings': dict((phase, Histogram()) for phase in TIMING_PHASES)}
+        return stats
+
+    def record(self, endpoint, timing, error=None):
+        """ timing -- dict of phase: ms; error -- e.g. 'http-500' or 'curl-28', None on success """
+        with self.lock:
+            stats = self.__endpoint(endpoint)
+            stats['requests'] += 1
+            for phase, value in timing.iteritems():
+                stats['timings'][phase].add(value)
+            if error:
+                stats['errors'][error] = stats['errors'].get(error, 0) + 1
+
+    def summary(self):
+        with self.lock:
+            return dict((endpoint, {'requests': stats['requests'],
+                                    'errors': dict(stats['errors']),
+                                    'timings': dict((phase, h.summary()) for phase, h in stats['timings'].iteritems())})
+                        for endpoint, stats in self.endpoints.iteritems())
+
+
+def request_timing(c):
+    """ Phases (ms) of the last transfer of a cURL handle """
+    dns = c.getinfo(pycurl.NAMELOOKUP_TIME)
+    connect = c.getinfo(pycurl.CONNECT_TIME)
+    tls = c.getinfo(pycurl.APPCONNECT_TIME)
+    pretransfer = c.getinfo(pycurl.PRETRANSFER_TIME)
+    return {'dns': dns * 1000,
+            'connect': max(connect - dns, 0) * 1000,
+            'tls': max(tls - connect, 0) * 1000 if tls else 0.0,
+            'ttfb': max(c.getinfo(pycurl.STARTTRANSFER_TIME) - pretransfer, 0) * 1000,
+            'total': c.getinfo(pycurl.TOTAL_TIME) * 1000}
+
+
+class ServiceRegistry(object):
+    """
+    Cache of the Opencast service registry by service type and of the DNS
+    lookups of the hosts in it. Expired entries are still returned while a
+    background thread refreshes them, so only the very first lookup of a
+    service type waits for the network.
+    """
+
+    def __init__(self, fetch, logger=None, ttl=SERVICES_TTL, dns_ttl=DNS_TTL):
+        self.fetch = fetch
+        self.logger = logger
+        self.ttl = ttl
+        self.dns_ttl = dns_ttl
+        self.services = {}
+        self.addresses = {}
+        self.refreshing = set()
+        self.lock = threading.Lock()
+
+    def get(self, service_type):
+        """ List of the services of a type, in the order of the registry (less loaded first) """
+        with self.lock:
+            entry = self.services.get(service_type)
+        if entry is None:
+            return self.refresh(service_type)
+        if time.time() - entry[0] > self.ttl:
+            self.refresh_async(service_type)
+        return entry[1]
+
+    def refresh(self, service_type):
+        services = self.fetch(service_type)
+        if not isinstance(services, list):
+            services = [services] if services else []
+        for service in services:
+            host = service_host(service['host'])
+            try:
+                self.resolve(host, True)
+            except Exception as exc:
+                # left to the lazy lookup in verify_ingest_server, which skips the node
+                self.logger and self.logger.warning('Could not resolve {}: {}'.format(host, exc))
+        with self.lock:
+            self.services[service_type] = (time.time(), services)
+        return services
+
+    def refresh_async(self, service_type):
+        with self.lock:
+            if service_type in self.refreshing:
+                return
+            self.refreshing.add(service_type)
+
+        def run():
+            try:
+                self.refresh(service_type)
+            except Exception as exc:
+                self.logger and self.logger.warning('Could not refresh the {} services: {}'.format(service_type, exc))
+            finally:
+                with self.lock:
+                    self.refreshing.discard(service_type)
+        thread = threading.Thread(target=run)
+        thread.setDaemon(True)
+        thread.start()
+
+    def invalidate(self, service_type):
+        """ Refresh a service type in the background, e.g. after a node failed """
+        with self.lock:
+            entry = self.services.get(service_type)
+            if entry is not None:
+                self.services[service_type] = (0, entry[1])
+        self.refresh_async(service_type)
+
+    def resolve(self, host, force=False):
+        """ Cached socket.gethostbyname """
+        with self.lock:
+            entry = self.addresses.get(host)
+        if entry is None or force or time.time() - entry[0] > self.dns_ttl:
+            try:
+                entry = (time.time(), socket.gethostbyname(host))
+            except Exception:
+                if entry is None or force:
+                    raise
+                # keep the last address while the DNS is unreachable
+            with self.lock:
+                self.addresses[host] = entry
+        return entry[1]
+
+
+def scan_etag(line, response):
+    if line.startswith('ETag:'):
+        response['ETag'] = line[5:].strip()
+
+
+def service_host(url):
+    return re.search('(?:http.*://)?(?P<host>[^:/ ]+).?(?P<port>[0-9]*).*', url).group('host')
+
+
+class NodeStats(object):
+    """ Moving averages of the ingest throughput (bytes/s) and error rate of each ingest node """
+
+    def __init__(self, alpha=NODE_STATS_ALPHA):
+        self.alpha = alpha
+        self.nodes = {}
+        self.lock = threading.Lock()
+
+    def record(self, node, size, seconds, ok):
+        with self.lock:
+            throughput, errors = self.nodes.get(node, (None, 0.0))
+            if ok and seconds > 0 and size:
+                rate = size / seconds
+                throughput = rate if throughput is None else throughput + self.alpha * (rate - throughput)
+            errors += self.alpha * ((0.0 if ok else 1.0) - errors)
+            self.nodes[node] = (throughput, errors)
+
+    def choose(self, nodes):
+        """
+        Best node by expected throughput (throughput * success rate). Nodes
+        without measures get the best known throughput so they are tried, ties
+        keep the order given (the registry load order).
+        """
+        with self.lock:
+            stats = [self.nodes.get(node, (None, 0.0)) for node in nodes]
+        known = [throughput for throughput, errors in stats if throughput is not None]
+        default = max(known) if known else 1.0
+        scores = [((default if throughput is None else throughput) * (1.0 - errors), -i)
+                  for i, (throughput, errors) in enumerate(stats)]
+        return nodes[max(range(len(nodes)), key=lambda i: scores[i])] if nodes else None
+
+
+class UploadGovernor(object):
+    """
+    Token bucket shared by all the uploads of a client. The rate can change
+    at any time, also in the middle of an upload: cURL options cannot be set
+    while a transfer runs, so instead of MAX_SEND_SPEED_LARGE the progress
+    callback of every ingest upload sleeps until the bytes it sent fit the rate.
+    """
+
+    def __init__(self, rate=0):
+        self.lock = threading.Lock()
+        self.set_rate(rate)
+
+    def set_rate(self, rate):
+        """ Bytes per second, 0 for no limit """
+        with self.lock:
+            self.rate = max(int(rate or 0), 0)
+            self.tokens = self.rate
+            self.last = time.time()
+
+    def consume(self, sent):
+        """ Account for sent bytes, returns the seconds to wait before sending more """
+        with self.lock:
+            if not self.rate:
+                return 0
+            now = time.time()
+            self.tokens = min(self.tokens + (now - self.last) * self.rate, self.rate) - sent
+            self.last = now
+            return -self.tokens / float(self.rate) if self.tokens < 0 else 0
+
+    def callback(self):
+        """ Progress function for a cURL handle """
+        state = {'sent': 0}
+
+        def progress(dltotal, dlnow, ultotal, ulnow):
+            sent, state['sent'] = ulnow - state['sent'], ulnow
+            if sent > 0:
+                wait = self.consume(sent)
+                while wait > 0:
+                    time.sleep(min(wait, MAX_THROTTLE_WAIT))
+                    wait = self.consume(0)
+            return 0
+        return progress
+
+
+class StreamReader(object):
+    """
+    File-like reader over a generator of byte strings, used as a cURL
+    READFUNCTION. Seeking back to the start restarts the generator so cURL
+    can resend the body (e.g. after the Digest challenge).
+    """
+
+    def __init__(self, factory, progress=None):
+        self.factory = factory
+        self.progress = progress
+        self.seek(0, 0)
+
+    def read(self, size):
+        while len(self.buffer) < size:
+            block = next(self.blocks, None)
+            if block is None:
+                break
+            self.buffer += block
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        self.sent += len(data)
+        if data and self.progress:
+            self.progress(self.sent)
+        return data
+
+    def seek(self, offset, origin):
+        if offset != 0 or origin != 0:
+            return pycurl.SEEKFUNC_CANTSEEK
+        self.blocks = iter(self.factory())
+        self.buffer = ''
+        self.sent = 0
+        return pycurl.SEEKFUNC_OK
+
+
+def zip_stream(entries, block_size=STREAM_BLOCK_SIZE):
+    """
+    Generate a stored (not deflated) zip of entries without seeking, so it can
+    be written straight into a request body. The CRC and sizes of every entry
+    go in a data descriptor after its data; entries of 4GB or more and
+    archives bigger than that use the zip64 extensions.
+
+    entries -- List of (name in the zip, file path) tuples.
+    """
+    fit = lambda value: 0xFFFFFFFF if value >= ZIP64_LIMIT else value
+    offset = 0
+    central = []
+    for name, path in entries:
+        size = os.path.getsize(path)
+        mtime = time.localtime(os.path.getmtime(path))
+        dostime = mtime.tm_hour << 11 | mtime.tm_min << 5 | mtime.tm_sec // 2
+        dosdate = (mtime.tm_year - 1980) << 9 | mtime.tm_mon << 5 | mtime.tm_mday
+        flags = 0x08
+        if isinstance(name, unicode):
+            name, flags = name.encode('utf-8'), flags | 0x800
+        zip64 = size >= ZIP64_LIMIT
+        version = 45 if zip64 else 20
+
+        extra = struct.pack('<HHQQ', 0x0001, 16, 0, 0) if zip64 else ''
+        header = struct.pack('<IHHHHHIIIHH', 0x04034b50, version, flags, 0, dostime, dosdate,
+                             0, 0xFFFFFFFF if zip64 else 0, 0xFFFFFFFF if zip64 else 0, len(name), len(extra))
+        yield header + name + extra
+
+        crc = 0
+        written = 0
+        with open(path, 'rb') as f:
+            while True:
+                block = f.read(block_size)
+                if not block:
+                    break
+                crc = zlib.crc32(block, crc)
+                written += len(block)
+                yield block
+        crc &= 0xFFFFFFFF
+        if written != size:
+            raise IOError, 'File {} changed size while being streamed'.format(path)
+
+        yield struct.pack('<IIQQ' if zip64 else '<IIII', 0x08074b50, crc, size, size)
+        central.append((name, flags, version, dostime, dosdate, crc, size, offset))
+        offset += len(header) + len(name) + len(extra) + size + (24 if zip64 else 16)
+
+    cd_offset = offset
+    cd_size = 0
+    for name, flags, version, dostime, dosdate, crc, size, header_offset in central:
+        fields = [value for value in (size, size, header_offset) if value >= ZIP64_LIMIT]
+        extra = struct.pack('<HH' + 'Q' * len(fields), 0x0001, 8 * len(fields), *fields) if fields else ''
+        record = struct.pack('<IHHHHHHIIIHHHHHII', 0x02014b50, version, 45 if extra else version, flags, 0,
+                             dostime, dosdate, crc, fit(size), fit(size),
+                             len(name), len(extra), 0, 0, 0, 0o644 << 16, fit(header_offset))
+        record += name + extra
+        cd_size += len(record)
+        yield record
+
+    count = len(central)
+    if count >= 0xFFFF or cd_offset >= ZIP64_LIMIT or cd_size >= ZIP64_LIMIT:
+        yield struct.pack('<IQHHIIQQQQ', 0x06064b50, 44, 45, 45, 0, 0, count, count, cd_size, cd_offset)
+        yield struct.pack('<IIQI', 0x07064b50, 0, cd_offset + cd_size, 1)
+    yield struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, min(count, 0xFFFF), min(count, 0xFFFF),
+                      fit(cd_size), fit(cd_offset), 0)
+
+
+def multipart_stream(fields, name, filename, content_type, body, boundary):
+    """ Generate a multipart/form-data body with the given fields followed by a file part streamed from body """
+    for key, value in fields:
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        yield '--{}\r\nContent-Disposition: form-data; name="{}"\r\n\r\n{}\r\n'.format(boundary, key, value)
+    yield '--{}\r\nContent-Disposition: form-data; name="{}"; filename="{}"\r\nContent-Type: {}\r\n\r\n'.format(
+        boundary, name, filename, content_type)
+    for block in body:
+        yield block
+    yield '\r\n--{}--\r\n'.format(boundary)
+
 
 class OCHTTPClient(object):
 
     def __init__(self, server, user, password, hostname='galicaster', address=None, multiple_ingest=False,
                  connect_timeout=2, timeout=2, workflow='full', workflow_parameters={'trimHold':'true'},
-                 ca_parameters={}, polling_short=10, polling_long=60, repo=None, logger=None):
+                 ca_parameters={}, polling_short=10, polling_long=60, repo=None, logger=None,
+                 reuse_connections=True, chunked_ingest=False, chunk_size=INGEST_CHUNK_SIZE,
+                 streaming_ingest=False, upload_rate=0, retry_policy=None, state_outbox=True):
         """
         Arguments:
 
@@ -68,6 +679,15 @@ class OCHTTPClient(object):
         ca_parameters -- Dict of parameters used as configuration, optional empty by default.
         logger -- Logger service.
         repo -- Repository service.
+        reuse_connections -- Keep cURL handles and connections alive between requests, optional True by default.
+        chunked_ingest -- ingest_mediapackage sends the tracks in resumable chunks, optional False by default.
+        chunk_size -- Size in bytes of the chunks of a chunked ingest, optional 8MB by default.
+        streaming_ingest -- ingest_mediapackage streams a zip generated on the fly, optional False by default.
+        upload_rate -- Limit in bytes per second for the uploads, optional 0 (no limit) by default.
+        retry_policy -- RetryPolicy of the idempotent endpoints and create_series, optional RetryPolicy() by default.
+        state_outbox -- Queue the agent and recording state updates and send them in the background: True to keep
+                        them in the repository (or only in memory without one), a file path, or False to send
+                        them synchronously. Optional True by default.
         """
         self.server = server
         self.user = user
@@ -98,92 +718,274 @@ class OCHTTPClient(object):
         # FIXME should be long? https://github.com/teltek/Galicaster/issues/114
         self.polling_caps = polling_short
         self.polling_config = polling_long
-        self.response = {'Status-Code': '', 'Content-Type': '', 'ETag': ''}
         self.ical_etag = -1
+        self.curl_pool = CurlPool() if reuse_connections else None
+        self.chunked_ingest = chunked_ingest
+        self.chunk_size = chunk_size
+        self.streaming_ingest = streaming_ingest
+        self.upload_governor = UploadGovernor(upload_rate)
+        self.registry = ServiceRegistry(self._get_endpoints, logger)
+        self.node_stats = NodeStats()
+        self.stats = RequestStats()
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.retry_policies = dict((endpoint, self.retry_policy) for endpoint in RETRY_ENDPOINTS)
+        self.__series_creates = {}
+        # items, hash and time of the last configuration the server accepted
+        self.conf_items = None
+        self.conf_hash = None
+        self.conf_sent = 0
+        self.outbox = None
+        if state_outbox:
+            path = state_outbox if isinstance(state_outbox, basestring) else (repo and repo.get_attach_path(OUTBOX_FILE))
+            self.outbox = StateOutbox(self.__post_state, path, logger)
+        self.__series_creates_lock = threading.Lock()
+        # callable(mp_id, sent_bytes, total_bytes) called while a chunked or streamed ingest progresses
+        self.ingest_progress = None
 
 
 
     def __call(self, method, endpoint, path_params={}, query_params={}, postfield={}, urlencode=True, server=None, timeout=True, headers={}):
+        return self.__request(method, endpoint, path_params, query_params, postfield, urlencode, server, timeout, headers)[0]
 
-        theServer = server or self.server
+    def set_retry_policy(self, endpoint, policy):
+        """ Retry failed requests to an endpoint (template, e.g. GET_USER_ENDPOINT) with a RetryPolicy, None to never retry """
+        if policy is None:
+            self.retry_policies.pop(endpoint, None)
+        else:
+            self.retry_policies[endpoint] = policy
 
-        url = list(urlparse.urlparse(theServer, 'http'))
-        url[2] = urlparse.urljoin(url[2], endpoint.format(**path_params))
-        url[4] = urllib.urlencode(query_params)
+    def __retry(self, endpoint, send, policy=None):
+        """ Call send, retrying it as the policy (by default the one of the endpoint) allows """
+        policy = policy or self.retry_policies.get(endpoint)
+        if policy is None:
+            return send()
+        policy.request()
+        attempt = 0
+        while True:
+            try:
+                return send()
+            except Exception as exc:
+                delay = policy.delay(attempt) if retryable(exc) else None
+                if delay is None:
+                    raise
+                self.logger and self.logger.warning('Retrying {} in {:.2f}s after: {}'.format(endpoint, delay, exc))
+                time.sleep(delay)
+                attempt += 1
+
+    def __request(self, method, endpoint, path_params={}, query_params={}, postfield={}, urlencode=True, server=None, timeout=True, headers={}):
+        """ Like __call, but returns the body and the response metadata (Status-Code, Content-Type, ETag, Timing) """
+        return self.__retry(endpoint, lambda: self.__request_once(method, endpoint, path_params, query_params, postfield,
+                                                                  urlencode, server, timeout, headers))
+
+    def __request_once(self, method, endpoint, path_params={}, query_params={}, postfield={}, urlencode=True, server=None, timeout=True, headers={}):
 
         c = b = None
         try:
-            c = pycurl.Curl()
-
-            c.setopt(pycurl.URL, urlparse.urlunparse(url))
-
-            c.setopt(pycurl.FOLLOWLOCATION, False)
-            c.setopt(pycurl.CONNECTTIMEOUT, self.connect_timeout)
-            if timeout:
-                c.setopt(pycurl.TIMEOUT, self.timeout)
-            c.setopt(pycurl.NOSIGNAL, 1)
-            c.setopt(pycurl.HTTPAUTH, pycurl.HTTPAUTH_DIGEST)
-            c.setopt(pycurl.USERPWD, self.user + ':' + self.password)
-            sendheaders = ['X-Requested-Auth: Digest', 'X-Opencast-Matterhorn-Authorization: true']
-            if headers:
-                for h, v in headers.iteritems():
-                    sendheaders.append('{}: {}'.format(h, v))
-                # implies we might be interested in passing the response headers
-                c.setopt(pycurl.HEADERFUNCTION, self.scanforetag)
-            c.setopt(pycurl.HTTPHEADER, sendheaders)
-            c.setopt(pycurl.USERAGENT, 'Galicaster' + version)
-            c.setopt(pycurl.SSL_VERIFYPEER, False) # equivalent to curl's --insecure
-
-            if (method == 'POST'):
-                if urlencode:
-                    c.setopt(pycurl.POST, 1)
-                    c.setopt(pycurl.POSTFIELDS, urllib.urlencode(postfield))
-                else:
-                    c.setopt(pycurl.HTTPPOST, postfield)
-
-            b = StringIO()
-            c.setopt(pycurl.WRITEFUNCTION, b.write)
+            c = self.__acquire()
+            b, response = self.__setup(c, method, endpoint, path_params, query_params, postfield, urlencode, server, timeout, headers)
 
             #c.setopt(pycurl.VERBOSE, True) ##TO DEBUG
-            c.perform()
-
-            status_code = c.getinfo(pycurl.HTTP_CODE)
-            self.response['Status-Code'] = status_code
-            self.response['Content-Type'] = c.getinfo(pycurl.CONTENT_TYPE)
-
-            if status_code != 200 and status_code != 302 and status_code != 304:
-                if (status_code > 200) and (status_code < 300):
-                    self.logger and self.logger.warning("Opencast client ({}) sent a response with status code {}".format(urlparse.urlunparse(url), status_code))
-                else:
-                    title = self.find_between(b.getvalue(), "<title>", "</title>")
-                    self.logger and self.logger.error('call error in %s, status code {%r}: %s',
-                                                      urlparse.urlunparse(url), status_code, title)
-                    raise IOError, 'Error in Opencast client'
+            try:
+                c.perform()
+            except pycurl.error as exc:
+                self.__failed(c, endpoint, exc)
+                raise
 
-            return b.getvalue()
+            return self.__check(c, b, response), response
         except IOError:
             # Do not wrap the IOError. We raise it ourselves
             raise
         except Exception as exc:
             raise RuntimeError, exc
         finally:
-            if c is not None:
+            self.__release(c, b)
+
+    def multi_call(self, requests, cancel=None):
+        """
+        Run several independent requests concurrently on a pycurl.CurlMulti,
+        so the batch takes as long as its slowest request.
+
+        requests -- List of dicts with the keyword arguments of a single call:
+                    method, endpoint and optionally path_params, query_params,
+                    postfield, urlencode, server, timeout, headers.
+        cancel -- threading.Event that aborts the unfinished requests when set, optional.
+
+        Returns a list with a (body, error) tuple per request, in order; error is
+        None on success and the exception a single call would have raised otherwise.
+        """
+        results = [(None, None)] * len(requests)
+        transfers = []
+        m = pycurl.CurlMulti()
+        try:
+            for i, request in enumerate(requests):
+                c = b = None
+                try:
+                    c = self.__acquire()
+                    b, response = self.__setup(c, **request)
+                    m.add_handle(c)
+                    transfers.append((i, c, b, response))
+                except Exception as exc:
+                    self.__release(c, b)
+                    results[i] = (None, RuntimeError(exc))
+
+            errors = {}
+            finished = set()
+            active = len(transfers)
+            while active and not (cancel and cancel.is_set()):
+                ret, active = m.perform()
+                if ret == pycurl.E_CALL_MULTI_PERFORM:
+                    continue
+                while True:
+                    queued, ok, failed = m.info_read()
+                    finished.update(id(c) for c in ok)
+                    for c, errno, message in failed:
+                        finished.add(id(c))
+                        errors[id(c)] = pycurl.error(errno, message)
+                    if not queued:
+                        break
+                if active:
+                    m.select(0.1 if cancel else 1.0)
+
+            for i, c, b, response in transfers:
+                if id(c) not in finished:
+                    results[i] = (None, RuntimeError('Request cancelled'))
+                    continue
+                if id(c) in errors:
+                    self.__failed(c, response['Endpoint'], errors[id(c)])
+                    results[i] = (None, RuntimeError(errors[id(c)]))
+                    continue
+                try:
+                    results[i] = (self.__check(c, b, response), None)
+                except Exception as exc:
+                    results[i] = (None, exc)
+        finally:
+            for i, c, b, response in transfers:
                 try:
-                    c.close()
-                except Exception as e:
-                    # We did our best!
-                    self.logger and self.logger.warning("Could not close cURL object properly: {}", e)
-            if b is not None:
+                    m.remove_handle(c)
+                except Exception:
+                    pass
+                self.__release(c, b)
+            m.close()
+
+        for i, (body, error) in enumerate(results):
+            request = requests[i]
+            if cancel and cancel.is_set():
+                break
+            if error is not None and retryable(error) and request['endpoint'] in self.retry_policies:
                 try:
-                    b.close()
-                except Exception as e:
-                    # We did our best!
-                    self.logger and self.logger.warning("Could not close StringIO object properly: {}", e)
+                    results[i] = (self.__request(**request)[0], None)
+                except Exception as exc:
+                    results[i] = (None, exc)
+
+        return results
+
+    def __acquire(self):
+        return self.curl_pool.acquire() if self.curl_pool else pycurl.Curl()
+
+    def __setup(self, c, method, endpoint, path_params={}, query_params={}, postfield={}, urlencode=True, server=None, timeout=True, headers={}):
+        """ Set the options of a request on a cURL handle, returns the body buffer and the response metadata """
+
+        theServer = server or self.server
 
-    def scanforetag(self, buffer):
-        if buffer.startswith('ETag:'):
-            etag = buffer[5:]
-            self.response['ETag'] = etag.strip()
+        url = list(urlparse.urlparse(theServer, 'http'))
+        url[2] = urlparse.urljoin(url[2], endpoint.format(**path_params))
+        url[4] = urllib.urlencode(query_params)
+        url = urlparse.urlunparse(url)
+
+        c.setopt(pycurl.URL, url)
+        response = {'URL': url, 'Endpoint': endpoint, 'Status-Code': None, 'Content-Type': None, 'ETag': '', 'Timing': {}}
+
+        c.setopt(pycurl.FOLLOWLOCATION, False)
+        c.setopt(pycurl.CONNECTTIMEOUT, self.connect_timeout)
+        if timeout:
+            c.setopt(pycurl.TIMEOUT, self.timeout)
+        c.setopt(pycurl.NOSIGNAL, 1)
+        c.setopt(pycurl.HTTPAUTH, pycurl.HTTPAUTH_DIGEST)
+        c.setopt(pycurl.USERPWD, self.user + ':' + self.password)
+        sendheaders = ['X-Requested-Auth: Digest', 'X-Opencast-Matterhorn-Authorization: true']
+        if headers:
+            for h, v in headers.iteritems():
+                sendheaders.append('{}: {}'.format(h, v))
+            # implies we might be interested in passing the response headers
+            c.setopt(pycurl.HEADERFUNCTION, lambda line: scan_etag(line, response))
+        c.setopt(pycurl.HTTPHEADER, sendheaders)
+        c.setopt(pycurl.USERAGENT, 'Galicaster' + version)
+        c.setopt(pycurl.SSL_VERIFYPEER, False) # equivalent to curl's --insecure
+
+        if (method == 'POST'):
+            if not timeout:
+                # only the ingest payloads are throttled, a small request would just wait for its response
+                c.setopt(pycurl.NOPROGRESS, 0)
+                c.setopt(getattr(pycurl, 'XFERINFOFUNCTION', pycurl.PROGRESSFUNCTION), self.upload_governor.callback())
+            if hasattr(postfield, 'read'):
+                # streamed body of unknown length
+                c.setopt(pycurl.POST, 1)
+                c.setopt(pycurl.READFUNCTION, postfield.read)
+                c.setopt(pycurl.SEEKFUNCTION, postfield.seek)
+            elif urlencode:
+                c.setopt(pycurl.POST, 1)
+                c.setopt(pycurl.POSTFIELDS, urllib.urlencode(postfield))
+            else:
+                c.setopt(pycurl.HTTPPOST, postfield)
+
+        b = StringIO()
+        c.setopt(pycurl.WRITEFUNCTION, b.write)
+        return b, response
+
+    def __check(self, c, b, response):
+        """ Check the status of a finished request and fill in its metadata, returns the body or raises IOError """
+        url = response['URL']
+        status_code = c.getinfo(pycurl.HTTP_CODE)
+        response['Status-Code'] = status_code
+        response['Content-Type'] = c.getinfo(pycurl.CONTENT_TYPE)
+        response['Timing'] = request_timing(c)
+        failed = not (200 <= status_code < 300 or status_code in (302, 304))
+        self.stats.record(response['Endpoint'], response['Timing'], 'http-{}'.format(status_code) if failed else None)
+
+        if status_code != 200 and status_code != 302 and status_code != 304:
+            if (status_code > 200) and (status_code < 300):
+                self.logger and self.logger.warning("Opencast client ({}) sent a response with status code {}".format(url, status_code))
+            else:
+                title = self.find_between(b.getvalue(), "<title>", "</title>")
+                self.logger and self.logger.error('call error in %s, status code {%r}: %s',
+                                                  url, status_code, title)
+                error = IOError('Error in Opencast client')
+                error.status_code = status_code
+                raise error
+
+        return b.getvalue()
+
+    def __release(self, c, b):
+        if c is not None:
+            try:
+                if self.curl_pool:
+                    self.curl_pool.release(c)
+                else:
+                    c.close()
+            except Exception as e:
+                # We did our best!
+                self.logger and self.logger.warning("Could not close cURL object properly: {}", e)
+        if b is not None:
+            try:
+                b.close()
+            except Exception as e:
+                # We did our best!
+                self.logger and self.logger.warning("Could not close StringIO object properly: {}", e)
+
+    def __failed(self, c, endpoint, exc):
+        """ Count a request that got no HTTP response """
+        self.stats.record(endpoint, request_timing(c), 'curl-{}'.format(exc.args[0] if exc.args else ''))
+
+    def get_stats(self):
+        """
+        Per endpoint number of requests, errors by kind ('http-<status>' or
+        'curl-<error code>') and a histogram summary (count, mean, max, p50,
+        p95, buckets) in ms of each request phase: dns, connect, tls, ttfb and total.
+        """
+        return self.stats.summary()
+
+    def reset_stats(self):
+        self.stats.reset()
 
     def whoami(self):
         return json.loads(self.__call('GET', ME_ENDPOINT))
@@ -195,14 +997,14 @@ class OCHTTPClient(object):
         return self.__call('GET', SERVICES_ENDPOINT)
 
     def ical(self):
-        icalendar = self.__call('GET', ICAL_ENDPOINT, query_params={'agentid': self.hostname}, headers={'If-None-Match': self.ical_etag})
+        icalendar, response = self.__request('GET', ICAL_ENDPOINT, query_params={'agentid': self.hostname}, headers={'If-None-Match': self.ical_etag})
 
-        if self.response['Status-Code'] == 304:
+        if response['Status-Code'] == 304:
             if self.logger:
                 self.logger.info("iCal Not modified")
             return None
 
-        self.ical_etag = self.response['ETag']
+        self.ical_etag = response['ETag']
         if self.logger:
                 self.logger.info("iCal modified")
         return icalendar
@@ -212,17 +1014,44 @@ class OCHTTPClient(object):
         Los posibles estados son: shutting_down, capturing, uploading, unknown, idle
         """
         self.logger and self.logger.info("Sending state {}".format(state))
-        return self.__call('POST', SETSTATE_ENDPOINT, {'hostname': self.hostname},
-                           postfield={'address': self.address, 'state': state})
+        return self.__send_state(('agent', self.hostname), SETSTATE_ENDPOINT, {'hostname': self.hostname},
+                                 {'address': self.address, 'state': state})
 
     def setrecordingstate(self, recording_id, state):
         """
         Los posibles estados son: unknown, capturing, capture_finished, capture_error, manifest,
         manifest_error, manifest_finished, compressing, compressing_error, uploading, upload_finished, upload_error
         """
-        return self.__call('POST', SETRECORDINGSTATE_ENDPOINT, {'id': recording_id}, postfield={'state': state})
+        return self.__send_state(('recording', recording_id), SETRECORDINGSTATE_ENDPOINT, {'id': recording_id},
+                                 {'state': state})
+
+    def __send_state(self, key, endpoint, path_params, postfield):
+        """
+        Queue a state update in the outbox and return at once. It still raises
+        the error of the last failed flush, so the caller knows the server is
+        unreachable.
+        """
+        if self.outbox is None:
+            return self.__post_state(endpoint, path_params, postfield)
+        self.outbox.put(key, endpoint, path_params, postfield)
+        self.outbox.check()
+        return ''
+
+    def __post_state(self, endpoint, path_params, postfield):
+        try:
+            return self.__call('POST', endpoint, path_params, postfield=postfield)
+        except Exception:
+            # the server may come back without our configuration
+            self.conf_hash = None
+            raise
+
 
     def setconfiguration(self, capture_devices):
+        """
+        Send the capture agent configuration, only when it changed since the
+        server last accepted it, after a failed state update or configuration
+        and every CONF_RESEND_INTERVAL seconds. Returns '' when nothing was sent.
+        """
         client_conf_xml = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
                              <!DOCTYPE properties SYSTEM "http://java.sun.com/dtd/properties.dtd">
                              <properties version="1.0">{0}</properties>"""
@@ -259,19 +1088,35 @@ class OCHTTPClient(object):
             }
 
         if self.repo:
-            client_conf['capture.cleaner.mindiskspace'] = self.repo.get_free_space()
+            free_space = self.repo.get_free_space()
+            client_conf['capture.cleaner.mindiskspace'] = free_space - free_space % CONF_FREE_SPACE_BUCKET
 
         client_conf.update(capture_devices)
         client_conf.update(self.ca_parameters)
 
-        xml = ""
-        for k, v in client_conf.iteritems():
-            xml = xml + client_conf_xml_body.format(key=k, value=v)
-        client_conf = client_conf_xml.format(xml)
-        return self.__call('POST', SETCONF_ENDPOINT, {'hostname': self.hostname}, postfield={'configuration': client_conf})
+        items = sorted(client_conf.iteritems())
+        fresh = self.conf_hash is not None and time.time() - self.conf_sent < CONF_RESEND_INTERVAL
+        if fresh and items == self.conf_items:
+            return ''
+
+        client_conf = client_conf_xml.format(''.join(client_conf_xml_body.format(key=k, value=v) for k, v in items))
+        conf_hash = hashlib.sha1(client_conf.encode('utf-8') if isinstance(client_conf, unicode) else client_conf).hexdigest()
+        if fresh and conf_hash == self.conf_hash:
+            self.conf_items = items
+            return ''
+
+        self.conf_hash = None
+        result = self.__call('POST', SETCONF_ENDPOINT, {'hostname': self.hostname}, postfield={'configuration': client_conf})
+        self.conf_items, self.conf_hash, self.conf_sent = items, conf_hash, time.time()
+        return result
 
     def _prepare_ingest(self, mp_file, workflow=None, workflow_instance=None, workflow_parameters=None):
         "refactor of ingest to unit test"
+        postdict = self._prepare_workflow(workflow, workflow_instance, workflow_parameters)
+        postdict[u'track'] = (pycurl.FORM_FILE, mp_file)
+        return postdict
+
+    def _prepare_workflow(self, workflow=None, workflow_instance=None, workflow_parameters=None):
         postdict = OrderedDict()
         postdict[u'workflowDefinitionId'] = workflow or self.workflow
         if workflow_instance:
@@ -282,7 +1127,6 @@ class OCHTTPClient(object):
             postdict.update(workflow_parameters)
         else:
             postdict.update(self.workflow_parameters)
-        postdict[u'track'] = (pycurl.FORM_FILE, mp_file)
         return postdict
 
     def _get_endpoints(self, service_type):
@@ -293,9 +1137,9 @@ class OCHTTPClient(object):
         return services['services']['service']
 
     def _get_search_server(self):
-        if not self.search_server:
-            service = self._get_endpoints(SEARCH_SERVICE_TYPE)
-            self.search_server = str(service['host'])
+        services = self.registry.get(SEARCH_SERVICE_TYPE)
+        if services:
+            self.search_server = str(services[0]['host'])
         return self.search_server
 
     def search_by_mp_id(self, mp_id):
@@ -312,19 +1156,16 @@ class OCHTTPClient(object):
         services are offline the ingest will still fall back to the server provided
         to Galicaster as then None will be returned by get_ingest_server  """
 
-        p = '(?:http.*://)?(?P<host>[^:/ ]+).?(?P<port>[0-9]*).*'
-        m = re.search(p,server['host'])
-        host=m.group('host')
-        m = re.search(p,self.server)
-        adminHost=m.group('host')
+        host = service_host(server['host'])
+        adminHost = service_host(self.server)
         if (not server['online']):
             return False
         if (server['maintenance']):
             return False
 
         try:
-            adminIP = socket.gethostbyname(adminHost);
-            hostIP  = socket.gethostbyname(host)
+            adminIP = self.registry.resolve(adminHost)
+            hostIP  = self.registry.resolve(host)
             if (adminIP != hostIP):
                 return True
             else:
@@ -336,25 +1177,279 @@ class OCHTTPClient(object):
         return False
 
     def get_ingest_server(self):
-        """ get the ingest server information from the admin node:
-        if there are more than one ingest servers the first from the list will be used
-        as they are returned in order of their load, if there is only one returned this
-        will be the admin node, so we can use the information we already have """
-        all_servers = self._get_endpoints(INGEST_SERVICE_TYPE)
-        if type(all_servers) is list:
-            for serv in all_servers:
-                if self.verify_ingest_server(serv):
-                    return str(serv['host']) # Returns less loaded served
-        if self.verify_ingest_server(all_servers):
-            return str(all_servers['host']) # There's only one server
-        return None # it will use the admin server
+        """ get the ingest server information from the (cached) service registry:
+        of the valid ingest servers, returned in order of their load, the one with the
+        best recent throughput and error rate is used. If there is only the admin node
+        None is returned, so we can use the information we already have """
+        return self.node_stats.choose(self.__ingest_servers()) # None will use the admin server
+
+    def __ingest_servers(self):
+        return [str(serv['host']) for serv in self.registry.get(INGEST_SERVICE_TYPE)
+                if self.verify_ingest_server(serv)]
+
+    def __timed_ingest(self, server, size, ingest):
+        """ Run an ingest, recording the throughput and errors of the node """
+        start = time.time()
+        try:
+            result = ingest()
+        except Exception:
+            self.node_stats.record(server or self.server, size, time.time() - start, False)
+            if self.multiple_ingest:
+                self.registry.invalidate(INGEST_SERVICE_TYPE)
+            raise
+        self.node_stats.record(server or self.server, size, time.time() - start, True)
+        return result
 
     def ingest(self, mp_file, mp_id, workflow=None, workflow_instance=None, workflow_parameters=None):
         postdict = self._prepare_ingest(mp_file, workflow, workflow_instance, workflow_parameters)
         server = self.server if not self.multiple_ingest else self.get_ingest_server()
         if self.logger:
             self.logger.info( 'Ingesting MP {} to Server {}'.format(mp_id, server) )
-        return self.__call('POST', INGEST_ENDPOINT, {}, {}, postdict.items(), False, server, False)
+        return self.__timed_ingest(server, os.path.getsize(mp_file), lambda: self.__call(
+            'POST', INGEST_ENDPOINT, {}, {}, postdict.items(), False, server, False))
+
+    def ingest_mediapackage(self, mp, workflow=None, workflow_instance=None, workflow_parameters=None):
+        """ Ingest a repository mediapackage straight from its folder, without a zip file on disk:
+        in resumable chunks (chunked_ingest) or as a zip generated while it is sent (streaming_ingest) """
+        if mp is None:
+            raise ValueError('Unknown mediapackage')
+        if self.chunked_ingest:
+            return self.ingest_chunked(mp, workflow, workflow_instance, workflow_parameters)
+        if self.streaming_ingest:
+            return self.ingest_stream(self.mediapackage_entries(mp), mp.getIdentifier(),
+                                      workflow, workflow_instance, workflow_parameters)
+        raise ValueError('Neither chunked nor streaming ingest is enabled')
+
+    def set_upload_rate(self, rate):
+        """ Change the upload limit (bytes per second, 0 for no limit), running uploads included """
+        if rate != self.upload_governor.rate:
+            self.logger and self.logger.info('Upload rate limit set to {}'.format(
+                '{} bytes/s'.format(rate) if rate else 'unlimited'))
+        self.upload_governor.set_rate(rate)
+
+    def set_ingest_mode(self, chunked=False, streaming=False, chunk_size=None):
+        """ Choose how ingest_mediapackage sends the repository mediapackages: in resumable chunks or
+        streamed as a zip generated on the fly. Chunked takes precedence """
+        self.chunked_ingest = chunked
+        self.streaming_ingest = streaming
+        if chunk_size:
+            self.chunk_size = chunk_size
+        self.logger and self.logger.info('Ingest mode set to {}'.format(
+            'chunked ({} bytes)'.format(self.chunk_size) if chunked else 'stream' if streaming else 'zip'))
+
+    def mediapackage_entries(self, mp):
+        """ Zip entries (name, path) of a mediapackage folder as saved by the repository: the manifest and its elements """
+        entries = OrderedDict()
+        manifest = os.path.join(mp.getURI(), ZIP_MANIFEST)
+        if os.path.isfile(manifest):
+            entries[ZIP_MANIFEST] = manifest
+        for element in mp.getElements():
+            path = element.getURI()
+            if os.path.isfile(path):
+                entries.setdefault(os.path.basename(path), path)
+        return entries.items()
+
+    def ingest_stream(self, entries, mp_id, workflow=None, workflow_instance=None, workflow_parameters=None,
+                      progress=None):
+        """
+        Ingest a zipped mediapackage without building the zip on disk: the
+        stored zip is generated from entries while cURL reads the request body,
+        sent with chunked transfer encoding.
+
+        entries -- List of (name in the zip, file path) tuples, see mediapackage_entries.
+        progress -- callable(mp_id, sent_bytes, total_bytes), optional self.ingest_progress by default.
+        """
+        progress = progress or self.ingest_progress
+        entries = list(entries)
+        total = sum(os.path.getsize(path) for name, path in entries)
+        fields = self._prepare_workflow(workflow, workflow_instance, workflow_parameters).items()
+        boundary = uuid.uuid4().hex
+        body = StreamReader(lambda: multipart_stream(fields, 'track', '{}.zip'.format(mp_id), 'application/zip',
+                                                     zip_stream(entries), boundary),
+                            progress and (lambda sent: progress(mp_id, min(sent, total), total)))
+
+        server = self.server if not self.multiple_ingest else self.get_ingest_server()
+        if self.logger:
+            self.logger.info('Streaming ingest of MP {} to Server {} ({} bytes)'.format(mp_id, server, total))
+        return self.__timed_ingest(server, total, lambda: self.__call(
+            'POST', INGEST_ENDPOINT, postfield=body, server=server, timeout=False,
+            headers={'Content-Type': 'multipart/form-data; boundary={}'.format(boundary),
+                     'Transfer-Encoding': 'chunked'}))
+
+    def ingest_chunked(self, mp, workflow=None, workflow_instance=None, workflow_parameters=None,
+                       progress=None, state_path=None):
+        """
+        Ingest a mediapackage element by element (createMediaPackage, addTrack,
+        addCatalog, addAttachment, ingest) instead of as one zip. Tracks go
+        through Opencast upload jobs in chunks of chunk_size bytes; the progress
+        is kept in a state file so a failed ingest resumes from the last chunk
+        the server acknowledged instead of from zero. Upload jobs and
+        mediapackages the server no longer knows (404) are created again, as is
+        the state of a node that is no longer an ingest server.
+
+        mp -- Mediapackage (getIdentifier, getURI, getTracks, getCatalogs, getAttachments).
+        progress -- callable(mp_id, sent_bytes, total_bytes), optional self.ingest_progress by default.
+        state_path -- File that keeps the resume state, optional ingest_state.json in the mediapackage folder.
+        """
+        mp_id = mp.getIdentifier()
+        progress = progress or self.ingest_progress
+        state_path = state_path or os.path.join(mp.getURI(), INGEST_STATE_FILE)
+        tracks = [t for t in mp.getTracks() if os.path.isfile(t.getURI())]
+        total = sum(os.path.getsize(t.getURI()) for t in tracks)
+
+        state = self.__load_ingest_state(state_path, mp_id)
+        if state.get('server') and state['server'] != self.server and \
+                (not self.multiple_ingest or state['server'] not in self.__ingest_servers()):
+            self.logger and self.logger.info('Ingest node {} of MP {} is gone, starting again'.format(state['server'], mp_id))
+            state = self.__new_ingest_state(mp_id)
+        if not state.get('server'):
+            state['server'] = (self.get_ingest_server() if self.multiple_ingest else None) or self.server
+
+        try:
+            return self.__ingest_elements(mp, state, state_path, workflow, workflow_instance, workflow_parameters,
+                                          progress, tracks, total)
+        except IOError as exc:
+            if not not_found(exc) or not state.get('mediapackage'):
+                raise
+            # the server lost the mediapackage (e.g. cleaned up), start this ingest over once
+            self.logger and self.logger.warning('MP {} is unknown on {}, starting the ingest again: {}'.format(
+                mp_id, state['server'], exc))
+            server = state['server']
+            state = self.__new_ingest_state(mp_id)
+            state['server'] = server
+            self.__save_ingest_state(state_path, state)
+            return self.__ingest_elements(mp, state, state_path, workflow, workflow_instance, workflow_parameters,
+                                          progress, tracks, total)
+
+    def __ingest_elements(self, mp, state, state_path, workflow, workflow_instance, workflow_parameters,
+                          progress, tracks, total):
+        mp_id = mp.getIdentifier()
+        server = state['server']
+
+        if not state.get('mediapackage'):
+            state['mediapackage'] = self.__call('GET', INGEST_CREATE_MP_ENDPOINT, server=server)
+            self.__save_ingest_state(state_path, state)
+        self.logger and self.logger.info('Chunked ingest of MP {} to Server {} ({} bytes)'.format(mp_id, server, total))
+
+        sent = 0
+        for track in tracks:
+            path = track.getURI()
+            size = os.path.getsize(path)
+            element = state['elements'].setdefault(path, {})
+            if not element.get('done'):
+                url = self.__timed_ingest(server, size, lambda: self.__upload_track(
+                    state, state_path, element, track, size, server,
+                    lambda done: progress and progress(mp_id, sent + done, total)))
+                state['mediapackage'] = self.__call('POST', INGEST_ADD_TRACK_ENDPOINT, server=server, timeout=False,
+                                                    postfield={'url': url, 'flavor': track.getFlavor(),
+                                                               'mediaPackage': state['mediapackage']})
+                element['done'] = True
+                self.__save_ingest_state(state_path, state)
+            sent += size
+            progress and progress(mp_id, sent, total)
+
+        for endpoint, elements in ((INGEST_ADD_CATALOG_ENDPOINT, mp.getCatalogs()),
+                                   (INGEST_ADD_ATTACHMENT_ENDPOINT, mp.getAttachments())):
+            for element in elements:
+                path = element.getURI()
+                if not os.path.isfile(path) or state['elements'].get(path, {}).get('done'):
+                    continue
+                state['mediapackage'] = self.__call('POST', endpoint, server=server, urlencode=False, timeout=False,
+                                                    postfield=[('flavor', str(element.getFlavor())),
+                                                               ('mediaPackage', state['mediapackage']),
+                                                               ('BODY', (pycurl.FORM_FILE, str(path)))])
+                state['elements'][path] = {'done': True}
+                self.__save_ingest_state(state_path, state)
+
+        postdict = self._prepare_workflow(workflow, workflow_instance, workflow_parameters)
+        postdict[u'mediaPackage'] = state['mediapackage']
+        result = self.__call('POST', INGEST_INGEST_ENDPOINT, server=server, postfield=postdict, timeout=False)
+
+        try:
+            os.remove(state_path)
+        except OSError:
+            pass
+        return result
+
+    def __upload_track(self, state, state_path, element, track, size, server, progress):
+        """ Send a track through an upload job, resuming it if it was already created. Returns the track URL """
+        try:
+            return self.__upload_track_job(state, state_path, element, track, size, server, progress)
+        except IOError as exc:
+            if not not_found(exc) or not element.get('job'):
+                raise
+            # expired or cleaned up by the server, send the whole track again in a new job
+            self.logger and self.logger.warning('Upload job {} is unknown on {}, creating a new one: {}'.format(
+                element['job'], server, exc))
+            element.pop('job', None)
+            self.__save_ingest_state(state_path, state)
+            return self.__upload_track_job(state, state_path, element, track, size, server, progress)
+
+    def __upload_track_job(self, state, state_path, element, track, size, server, progress):
+        chunks = max((size + self.chunk_size - 1) // self.chunk_size, 1)
+        path = track.getURI()
+        filename = os.path.basename(path)
+
+        if not element.get('job') or element.get('chunk_size') != self.chunk_size or \
+                element.get('server', state['server']) != server:
+            element['job'] = self.__call('POST', UPLOAD_NEWJOB_ENDPOINT, server=server,
+                                         postfield={'filename': filename, 'filesize': size,
+                                                    'chunksize': self.chunk_size, 'flavor': track.getFlavor(),
+                                                    'mediapackage': state['mediapackage']}).strip()
+            element['chunk_size'] = self.chunk_size
+            element['server'] = server
+            self.__save_ingest_state(state_path, state)
+
+        status, last_chunk, url = self.__upload_job_status(element['job'], server)
+        if last_chunk >= 0:
+            self.logger and self.logger.info('Resuming upload of {} after chunk {} of {}'.format(filename, last_chunk + 1, chunks))
+
+        with open(path, 'rb') as f:
+            for number in range(last_chunk + 1, chunks):
+                f.seek(number * self.chunk_size)
+                data = f.read(self.chunk_size)
+                self.__call('POST', UPLOAD_JOB_ENDPOINT, {'job_id': element['job']}, server=server,
+                            urlencode=False, timeout=False,
+                            postfield=[('chunknumber', str(number)),
+                                       ('filedata', (pycurl.FORM_BUFFER, str(filename), pycurl.FORM_BUFFERPTR, data))])
+                progress(min((number + 1) * self.chunk_size, size))
+
+        if not url:
+            status, last_chunk, url = self.__upload_job_status(element['job'], server)
+        if not url:
+            raise IOError, 'Upload job {} of {} finished without a track URL ({})'.format(element['job'], filename, status)
+        return url
+
+    def __upload_job_status(self, job_id, server):
+        """ Returns the state, the last received chunk number (-1 for none) and the payload URL of an upload job """
+        job = json.loads(self.__call('GET', UPLOAD_JOB_STATUS_ENDPOINT, {'job_id': job_id}, server=server))
+        job = job.get('uploadjob', job)
+        current = job.get('currentchunk')
+        number = current.get('number', -1) if isinstance(current, dict) else -1
+        payload = job.get('payload') or {}
+        return job.get('state'), int(number), payload.get('url')
+
+    def __load_ingest_state(self, state_path, mp_id):
+        try:
+            with open(state_path) as f:
+                state = json.load(f)
+            if state.get('mp_id') == mp_id:
+                return state
+        except (IOError, OSError, ValueError):
+            pass
+        return self.__new_ingest_state(mp_id)
+
+    def __new_ingest_state(self, mp_id):
+        return {'mp_id': mp_id, 'server': None, 'mediapackage': None, 'elements': {}}
+
+    def __save_ingest_state(self, state_path, state):
+        tmp_path = state_path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(state, f)
+            os.rename(tmp_path, state_path)
+        except (IOError, OSError) as exc:
+            self.logger and self.logger.warning('Could not save ingest state {}: {}'.format(state_path, exc))
 
     def getseries(self, **query):
         """ Get series according to the page count and offset provided"""
@@ -406,15 +1501,85 @@ class OCHTTPClient(object):
         """
         return self.__call('GET', GET_PERSONAL_SERIES_ENDPOINT, {'user_id': user_id, 'filter': filter})
 
-    def create_series(self, _metadata, _acl):
+    def get_users(self, limit=100, offset=0):
+        """
+        Get a page of the Opencast users, returns a list of user dicts (username, name, email...)
+        """
+        users = json.loads(self.__call('GET', LIST_USERS_ENDPOINT, {'limit': limit, 'offset': offset}))
+        if isinstance(users, dict):
+            users = users.get('users', users)
+            if isinstance(users, dict):
+                users = users.get('user', [])
+        return users if isinstance(users, list) else [users]
+
+    def get_series(self, filter='', limit=100, offset=0):
+        """
+        Get a page of the series (External API) matching a filter (URL encoded, e.g. subject%3APersonal)
+        """
+        return json.loads(self.__call('GET', LIST_SERIES_ENDPOINT, {'filter': filter, 'limit': limit, 'offset': offset}))
+
+    def get_user_details_and_personal_series(self, user_id, filter, cancel=None):
+        """
+        Get user info and personal series info from Opencast concurrently,
+        returns a (body, error) tuple for each of them
+        """
+        return self.multi_call([
+            {'method': 'GET', 'endpoint': GET_USER_ENDPOINT, 'path_params': {'user_id': user_id}},
+            {'method': 'GET', 'endpoint': GET_PERSONAL_SERIES_ENDPOINT, 'path_params': {'user_id': user_id, 'filter': filter}}
+        ], cancel)
+
+    def create_series(self, _metadata, _acl, user_id=None, filter=''):
+        """
+        Create a series, retrying transient failures. When user_id is given the
+        call is idempotent: the existing personal series of the user (see
+        get_personal_series) is returned instead of creating another one, and
+        concurrent creates for the same user share a single request.
+        Returns the JSON body with the series identifier, or None on failure.
+        """
+        if not user_id:
+            return self.__create_series(_metadata, _acl, None, filter)
+
+        with self.__series_creates_lock:
+            pending = self.__series_creates.get(user_id)
+            owner = pending is None
+            if owner:
+                pending = self.__series_creates[user_id] = {'done': threading.Event(), 'result': None}
+        if not owner:
+            pending['done'].wait()
+            return pending['result']
 
-        result = None
         try:
+            pending['result'] = self.__create_series(_metadata, _acl, user_id, filter)
+        finally:
+            with self.__series_creates_lock:
+                del self.__series_creates[user_id]
+            pending['done'].set()
+        return pending['result']
+
+    def __create_series(self, _metadata, _acl, user_id, filter):
+        def send():
+            if user_id:
+                existing = self.__existing_series(user_id, filter)
+                if existing:
+                    self.logger and self.logger.info('create_series: {} already has series {}'.format(user_id, existing))
+                    return json.dumps({'identifier': existing})
             return self.__call('POST', CREATE_SERIES_ENDPOINT,
                 headers = {"Content-Type": "application/x-www-form-urlencoded; charset=ISO-8859-1"},
                 postfield = {'metadata': _metadata, 'acl': _acl})
 
+        try:
+            # without the check for an existing series a retry could create a duplicate
+            return self.__retry(CREATE_SERIES_ENDPOINT, send, self.retry_policy if user_id else None)
+
         except Exception as exc:
             self.logger and self.logger.error('create_series: {0}'.format(exc))
 
-        return result
+        return None
+
+    def __existing_series(self, user_id, filter):
+        """ Identifier of the personal series of a user, None if there is none """
+        series = json.loads(self.get_personal_series(user_id, filter))
+        for s in series if isinstance(series, list) else []:
+            if s.get('identifier'):
+                return s['identifier']
+        return None
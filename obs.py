@@ -18,18 +18,27 @@ import json
 import logging
 import errno
 import gi
+import math
+import mmap
+import os
 import re
 import requests
+import struct
+import tempfile
 import threading
+import time
 import serial.tools.list_ports
 
-from collections import namedtuple
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
 from datetime import timedelta, datetime, tzinfo
 from dateutil.parser import parse
+from dateutil.tz import gettz, tzutc
 from evdev import InputDevice, ecodes, list_devices
 from string import Template
 from tzlocal import get_localzone
 from time import sleep
+from zlib import crc32
 
 gi.require_version('Gtk', '3.0')
 
@@ -58,6 +67,79 @@ ACL = Template('[]')
 DEFAULT_SCHEDULE_URL = "https://camonitor.uct.ac.za/obs-api/event/"
 URL_SCHEDULE = "url_schedule"
 
+# Seconds to wait for the obs-api before giving up on a schedule fetch
+DEFAULT_SCHEDULE_TIMEOUT = 10
+CONFIG_SCHEDULE_TIMEOUT = "schedule_timeout"
+
+# Optional Server-Sent-Events stream of booking updates, polling is only used while it is down
+CONFIG_PUSH_URL = "url_push"
+# Seconds without any data (heartbeats included) before the stream is considered dead
+DEFAULT_PUSH_TIMEOUT = 90
+CONFIG_PUSH_TIMEOUT = "push_timeout"
+MAX_PUSH_RETRY = 60
+
+# Local copy of the last good booking feed, used at start up and while offline
+DEFAULT_SCHEDULE_CACHE = "obs_schedule.json"
+CONFIG_SCHEDULE_CACHE = "schedule_cache"
+SCHEDULE_CACHE_VERSION = 1
+
+# Time zone used to show and log booking times, defaults to the local zone
+CONFIG_TIMEZONE = "timezone"
+
+# Opencast upload limits in KB/s (0 for no limit) while recording and while idle,
+# so an ingest does not compete with the capture for the uplink and the disk
+CONFIG_UPLOAD_RATE_RECORDING = "upload_rate_recording"
+CONFIG_UPLOAD_RATE_IDLE = "upload_rate_idle"
+
+# How recordings are ingested: "zip" leaves it to Galicaster, which posts the zipped
+# mediapackage; with "stream" (zip generated while it is sent) and "chunked" (tracks in
+# resumable chunks of ingest_chunk_size MB) this plugin ingests when the recording stops
+DEFAULT_INGEST_MODE = "zip"
+CONFIG_INGEST_MODE = "ingest_mode"
+INGEST_MODES = ("zip", "stream", "chunked")
+DEFAULT_INGEST_CHUNK_SIZE = 8
+CONFIG_INGEST_CHUNK_SIZE = "ingest_chunk_size"
+# Attempts of a plugin ingest and seconds between them, a chunked ingest resumes each time
+INGEST_ATTEMPTS = 5
+INGEST_RETRY = 5 * 60
+# Ingest progress is logged (and signalled) in steps of this many percent
+INGEST_PROGRESS_STEP = 10
+
+# Resolved users kept in memory: entries, and seconds an entry is trusted for users
+# with a personal series, users without one and user ids that were not found
+DEFAULT_USER_CACHE_SIZE = 256
+CONFIG_USER_CACHE_SIZE = "user_cache_size"
+DEFAULT_SERIES_CACHE_TTL = 12 * 60 * 60
+CONFIG_SERIES_CACHE_TTL = "series_cache_ttl"
+DEFAULT_USER_CACHE_TTL = 60 * 60
+CONFIG_USER_CACHE_TTL = "user_cache_ttl"
+DEFAULT_NEGATIVE_CACHE_TTL = 5 * 60
+CONFIG_NEGATIVE_CACHE_TTL = "negative_cache_ttl"
+
+# Optional local snapshot of the Opencast users and their personal series, looked up
+# before asking Opencast; it is rebuilt every user_directory_sync seconds
+CONFIG_USER_DIRECTORY = "user_directory"
+DEFAULT_USER_DIRECTORY_SYNC = 6 * 60 * 60
+CONFIG_USER_DIRECTORY_SYNC = "user_directory_sync"
+USER_DIRECTORY_RETRY = 10 * 60
+USER_DIRECTORY_PAGE = 100
+USER_DIRECTORY_MAGIC = b'OBSU'
+USER_DIRECTORY_VERSION = 1
+
+# Type-ahead in "Get My Info": suggestions shown from this many typed characters, how
+# many, and the pause in typing (ms) before a user id that is not known locally is looked up
+TYPEAHEAD_MIN_PREFIX = 3
+TYPEAHEAD_SUGGESTIONS = 5
+SEARCH_DEBOUNCE = 400
+
+# Signals emitted on the dispatcher when the schedule or the current session change,
+# each one carries the Booking concerned
+OBS_SIGNALS = ['obs-booking-added', 'obs-booking-changed', 'obs-booking-removed',
+               'obs-session-started', 'obs-session-ended', 'obs-ingest-progress']
+
+# Longest single wait for a session boundary (ms), so wall clock changes are picked up
+MAX_TRANSITION_DELAY = 60 * 60 * 1000
+
 current_mediapackage = None
 
 config = context.get_conf().get_section(CONFIG_SECTION) or {}
@@ -67,6 +149,8 @@ logger = context.get_logger()
 recorder = context.get_recorder()
 oc_client = context.get_occlient()
 
+UTC = tzutc()
+
 # Simple function to print a message on each event
 def print_message(message):
     def dumb_echo(*args):
@@ -144,6 +228,51 @@ class OBSPlugin():
         self.time_details = None
         self.user_details = None
 
+        # parsed bookings, only replaced on the main loop
+        self.bookings = BookingIndex()
+        self.cache = ScheduleCache(self.__logger, get_schedule_cache_path())
+        schedule_timeout = int(config.get(CONFIG_SCHEDULE_TIMEOUT, DEFAULT_SCHEDULE_TIMEOUT))
+        self.fetcher = ScheduleFetcher(self.__logger, self.url, self._apply_schedule, schedule_timeout, self.cache)
+
+        # warm start from the last good schedule, before any network call
+        cached = self.fetcher.load_cached()
+        if cached is not None:
+            self.bookings = cached
+        self.fetcher.start()
+
+        self.push = None
+        if config.get(CONFIG_PUSH_URL):
+            self.push = SchedulePushClient(self.__logger, config.get(CONFIG_PUSH_URL), self._apply_schedule,
+                                           int(config.get(CONFIG_PUSH_TIMEOUT, DEFAULT_PUSH_TIMEOUT)),
+                                           self.cache, schedule_timeout)
+            self.push.current = self.bookings
+            self.push.start()
+
+        self.transitions = TransitionScheduler(self.__logger, self._update_session)
+        self.current_booking = None
+
+        self.prefetcher = UserPrefetcher(self.__logger, self.__oc_client,
+                                         config.get(CONFIG_SERIES_FILTER, DEFAULT_SERIES_FILTER))
+        self.prefetcher.start()
+
+        self.user_popup = None
+        self.ingester = None
+        self.directory = None
+        if config.get(CONFIG_USER_DIRECTORY):
+            self.directory = UserDirectory(self.__logger, config.get(CONFIG_USER_DIRECTORY))
+            UserDirectorySync(self.__logger, self.__oc_client, self.directory,
+                              config.get(CONFIG_SERIES_FILTER, DEFAULT_SERIES_FILTER),
+                              int(config.get(CONFIG_USER_DIRECTORY_SYNC, DEFAULT_USER_DIRECTORY_SYNC))).start()
+
+        self.set_upload_rate(recorder.is_recording())
+        self.set_ingest_mode()
+
+        for signal in OBS_SIGNALS:
+            dispatcher.add_new_signal(signal, True)
+
+        dispatcher.connect('obs-booking-changed', self._handle_booking_changed)
+        dispatcher.connect('obs-session-started', self._handle_session_started)
+        dispatcher.connect('obs-session-ended', self._handle_session_ended)
         dispatcher.connect('timer-short', self._handle_timer)
         dispatcher.connect('record-finished', self.stop_recording)
 
@@ -214,76 +343,107 @@ class OBSPlugin():
         self.box.show_all()
         self.__logger.info("Set user init done.")
 
-    def _handle_timer(self, sender):
+        # build "Get My Info" now so pressing the button only has to show it
+        self.user_popup = SetUserClass(self.__logger, title="Get My Info", client = self.__oc_client, directory = self.directory)
 
-        my_response = requests.get(self.url)
+        # show the state of the cached schedule without waiting for the obs-api
+        self._update_session()
+        self.prefetcher.prefetch(self.bookings, datetime.now(UTC))
 
-        self.__logger.info("handling timer")
+    def _handle_timer(self, sender):
+        """
+        Ask the schedule worker for a fresh booking list, this runs on the
+        GTK main loop so it must never touch the network. Session changes are
+        driven by the TransitionScheduler, not by this timer.
+        """
+        # updates arrive by themselves while the push stream is up
+        if self.push is None or not self.push.connected:
+            self.fetcher.fetch()
 
-        if (my_response.ok):
-            x = json.loads(my_response.content, object_hook=lambda d: namedtuple('X', d.keys())(*d.values()))
-            #self.__logger.info(x)
-            now = datetime.now(GMT2())
-            self.__logger.info("getting calendar events : " + str(now.astimezone(get_localzone())) +" ["+ str(self.is_recording) +"]")
-            isCurrent = False
+    def _apply_schedule(self, bookings):
+        """
+        Called on the main loop (via GLib.idle_add) by the schedule worker,
+        emits a signal per added, changed or removed booking
+        :param bookings: BookingIndex of the new schedule
+        :return: False so the idle source is removed
+        """
+        added, changed, removed = diff_bookings(self.bookings, bookings)
+        self.bookings = bookings
+        if self.push is not None:
+            self.push.current = bookings
+        self.__logger.info("obs schedule: {} added, {} changed, {} removed".format(
+            len(added), len(changed), len(removed)))
+
+        for booking in added:
+            dispatcher.emit('obs-booking-added', booking)
+        for booking in changed:
+            dispatcher.emit('obs-booking-changed', booking)
+        for booking in removed:
+            dispatcher.emit('obs-booking-removed', booking)
+
+        self._update_session()
+        self.prefetcher.prefetch(self.bookings, datetime.now(UTC))
+        return False
+
+    def _update_session(self):
+        """
+        Work out the current booking and emit obs-session-ended / obs-session-started
+        when it is a different booking than before
+        """
+        now = datetime.now(UTC)
+        self.__logger.info("getting calendar events : " + str(now.astimezone(LOCAL_ZONE)) +" ["+ str(self.is_recording) +"]")
+        current = self.bookings.current(now)
+        previous = self.current_booking
+        self.current_booking = current
+
+        if not same_booking(previous, current):
+            if previous is not None:
+                dispatcher.emit('obs-session-ended', previous)
+            if current is not None:
+                dispatcher.emit('obs-session-started', current)
+
+        # sleep until the next session starts or ends
+        self.transitions.arm(self.bookings, now)
+
+    def _handle_session_started(self, sender, booking):
+        self.__logger.info("scheduled event: " + str(booking.start.astimezone(LOCAL_ZONE)))
+        self.state = 1
+        self.end_time = booking.end
+        self._set_time_details(booking)
 
-            for line in x:
-                #if line.ocSeries is not None:
-                #self.__logger.info(line.ocSeries)
-                start = parse(line.start.dateTime + 'Z')
-                end = parse(line.end.dateTime + 'Z')
-                if start < now < end:
-                    self.__logger.info("scheduled event: " + str(start.astimezone(get_localzone())))
-                    self.state = 1
-                    self.end_time = end
-                    isCurrent = True
-
-                    # new details
-                    if self.time_details is None:
-                        self.time_details = {
-                            'series': line.ocSeries,
-                            'seriesTitle': line.ocSeriesTitle,
-                            'title': line.subject,
-                            'organizer': line.organizer.emailAddress.name,
-                            'organizerEmail': line.organizer.emailAddress.address,
-                            'take': 0
-                        }
-                        #recorder.title_standin = self.time_details['organizer'] in clear
-                        self.button_clear_user(None)
+        # if we are not recording then play with the lights - otherwise NO
+        if not self.is_recording:
+            self.set_status(self.state)
 
-                    else:
-                        # flow from one to a new one
-                        # if we have a recording and the series differ then set to new series
-                        if self.time_details['series'] != line.ocSeries:
-
-                            self.time_details = {
-                                'series': line.ocSeries,
-                                'seriesTitle': line.ocSeriesTitle,
-                                'title': line.subject,
-                                'organizer': line.organizer.emailAddress.name,
-                                'organizerEmail': line.organizer.emailAddress.address,
-                                'take': 0
-                            }
-                            #recorder.title_standin = self.time_details['organizer'] in clear
-                            self.button_clear_user(None)
-                else:
-                    recorder.title_standin = None
-                    #self.__logger.info("no event: " + str(start.astimezone(get_localzone())))
+    def _handle_session_ended(self, sender, booking):
+        if self.current_booking is not None:
+            # flows straight into the next session, obs-session-started follows
+            return
 
-            if isCurrent is False:
-                self.__logger.info("no current session")
-                self.state = 0
-                self.end_time = None
-                self.time_details = None
-                if self.user_details is None:
-                    recorder.title_standin = None
-            else:
-                self.state = 1
+        self.__logger.info("no current session")
+        self.state = 0
+        self.end_time = None
+        self.time_details = None
+        if self.user_details is None:
+            recorder.title_standin = None
 
-        # if we are not recording then play with the lights - otherwise NO
         if not self.is_recording:
             self.set_status(self.state)
 
+    def _handle_booking_changed(self, sender, booking):
+        if same_booking(self.current_booking, booking):
+            self.__logger.info("current booking changed")
+            self.end_time = booking.end
+            self._set_time_details(booking)
+
+    def _set_time_details(self, booking):
+        # new details, or flow from one to a new one:
+        # if we have a recording and the series differ then set to new series
+        if self.time_details is None or self.time_details['series'] != booking.series:
+            self.time_details = booking.details()
+            #recorder.title_standin = self.time_details['organizer'] in clear
+            self.button_clear_user(None)
+
     def on_key_press(self, widget, event):
         global recorder
         # logger.info("Key press on widget: {}".format(widget))
@@ -302,7 +462,7 @@ class OBSPlugin():
     def set_recording(self, is_recording):
         self.__logger.info("setting recording")
         self.is_recording = is_recording
-        now = datetime.now(GMT2())
+        now = datetime.now(UTC)
 
         if is_recording:
             self.state = 2
@@ -319,6 +479,45 @@ class OBSPlugin():
                 self.state = 0
 
         self.set_status(self.state)
+        self.set_upload_rate(is_recording)
+
+    def set_upload_rate(self, is_recording):
+        if self.__oc_client is None:
+            return
+        option = CONFIG_UPLOAD_RATE_RECORDING if is_recording else CONFIG_UPLOAD_RATE_IDLE
+        try:
+            rate = int(config.get(option, 0))
+        except ValueError:
+            self.__logger.warning("Invalid {} '{}', not limiting uploads".format(option, config.get(option)))
+            rate = 0
+        self.__oc_client.set_upload_rate(rate * 1024)
+
+    def set_ingest_mode(self):
+        if self.__oc_client is None:
+            return
+        mode = config.get(CONFIG_INGEST_MODE, DEFAULT_INGEST_MODE).strip().lower()
+        if mode not in INGEST_MODES:
+            self.__logger.warning("Invalid {} '{}', using {}".format(CONFIG_INGEST_MODE, mode, DEFAULT_INGEST_MODE))
+            mode = DEFAULT_INGEST_MODE
+        try:
+            chunk_size = int(config.get(CONFIG_INGEST_CHUNK_SIZE, DEFAULT_INGEST_CHUNK_SIZE))
+        except ValueError:
+            self.__logger.warning("Invalid {} '{}', using {} MB".format(
+                CONFIG_INGEST_CHUNK_SIZE, config.get(CONFIG_INGEST_CHUNK_SIZE), DEFAULT_INGEST_CHUNK_SIZE))
+            chunk_size = DEFAULT_INGEST_CHUNK_SIZE
+        self.__oc_client.set_ingest_mode(mode == "chunked", mode == "stream", max(chunk_size, 1) * 1024 * 1024)
+        if mode == DEFAULT_INGEST_MODE:
+            return
+
+        # the zip Galicaster would export first is never needed, so the plugin ingests instead of its worker
+        conf = context.get_conf()
+        for code in ('manual', 'scheduled'):
+            if (conf.get('ingest', code) or '').lower() not in ('', 'none'):
+                self.__logger.warning("[ingest] {} is '{}': Galicaster will also ingest its zip, set it to none "
+                                      "for the {} ingest mode".format(code, conf.get('ingest', code), mode))
+        self.ingester = MediapackageIngester(self.__logger, self.__oc_client)
+        self.ingester.start()
+        dispatcher.connect('recorder-stopped', self.ingester.handle_recorder_stopped)
 
     def set_status(self, status):
         self.__logger.info('switching to ' + str(status))
@@ -334,7 +533,10 @@ class OBSPlugin():
 
     def button_set_user(self, button):
         self.__logger.info("SET USER")
-        popup = SetUserClass(self.__logger, title="Get My Info", client = self.__oc_client)
+        if self.user_popup is None:
+            self.user_popup = SetUserClass(self.__logger, title="Get My Info", client = self.__oc_client, directory = self.directory)
+        popup = self.user_popup
+        popup.run()
 
         if popup.return_value == -10:
             self.btn_clear.set_sensitive(True) # enabled
@@ -350,7 +552,7 @@ class OBSPlugin():
             self.title.set_text("Live with " + self.user_details['organizer'])
             self.box.show_all()
             self.__logger.info("User details set to: "+ popup.id +" "+ popup.user_name)
-            recorder.title_standin = "Live with " + self.details['organizer']
+            recorder.title_standin = "Live with " + self.user_details['organizer']
 
         if popup.return_value == -7:
             self.__logger.info("Cancelled")
@@ -441,20 +643,606 @@ class OBSPlugin():
             })
         return mp
 
-class GMT2(tzinfo):
+class ZoneTable(tzinfo):
+    """
+    tzinfo answering from a per-year table of UTC offset transitions,
+    each year is computed once from the named zone and shared by all threads
+    """
+    def __init__(self, name):
+        self.name = name
+        self.__zone = gettz(name)
+        if self.__zone is None:
+            raise ValueError("Unknown time zone {}".format(name))
+        self.__years = {}
+        self.__lock = threading.Lock()
+
+    def __repr__(self):
+        return "ZoneTable({!r})".format(self.name)
+
     def utcoffset(self, dt):
-        return timedelta(hours=2) + self.dst(dt)
+        return self.__lookup(dt)[0]
+
     def dst(self, dt):
-        d = datetime(dt.year, 4, 1)
-        self.dston = d - timedelta(days=d.weekday() + 1)
-        d = datetime(dt.year, 11, 1)
-        self.dstoff = d - timedelta(days=d.weekday() + 1)
-        if self.dston <=  dt.replace(tzinfo=None) < self.dstoff:
-            return timedelta(hours=1)
+        return self.__lookup(dt)[1]
+
+    def tzname(self, dt):
+        return self.__lookup(dt)[2]
+
+    def fromutc(self, dt):
+        utc = dt.replace(tzinfo=None)
+        table = self.__year(utc.year)
+        i = max(bisect_right(table['utc'], utc) - 1, 0)
+        return (utc + table['periods'][i][0]).replace(tzinfo=self)
+
+    def __lookup(self, dt):
+        local = dt.replace(tzinfo=None)
+        table = self.__year(local.year)
+        i = max(bisect_right(table['local'], local) - 1, 0)
+        # a wall time repeated when the clocks go back is the first occurrence,
+        # as with dateutil, unless the second one is asked for with fold=1
+        if i > 0 and local < table['utc'][i] + table['periods'][i - 1][0] and not getattr(dt, 'fold', 0):
+            i -= 1
+        return table['periods'][i]
+
+    def __year(self, year):
+        table = self.__years.get(year)
+        if table is None:
+            table = self.__build(year)
+            with self.__lock:
+                table = self.__years.setdefault(year, table)
+        return table
+
+    def __period(self, utc):
+        local = utc.replace(tzinfo=UTC).astimezone(self.__zone)
+        return (local.utcoffset(), local.dst() or timedelta(0), local.tzname())
+
+    def __build(self, year):
+        """
+        Find the transitions of the year by sampling the zone once a day and
+        narrowing every change down to the second
+        """
+        utc = datetime(year, 1, 1) - timedelta(days=1)
+        period = self.__period(utc)
+        utc_starts = [utc]
+        periods = [period]
+
+        day = timedelta(days=1)
+        while utc.year <= year:
+            candidate = self.__period(utc + day)
+            if candidate != period:
+                low, high = 0, 24 * 60 * 60
+                while high - low > 1:
+                    middle = (low + high) // 2
+                    if self.__period(utc + timedelta(seconds=middle)) == period:
+                        low = middle
+                    else:
+                        high = middle
+                high = utc + timedelta(seconds=high)
+                period = self.__period(high)
+                utc_starts.append(high)
+                periods.append(period)
+            utc += day
+
+        return {
+            'utc': utc_starts,
+            'local': [start + p[0] for start, p in zip(utc_starts, periods)],
+            'periods': periods
+        }
+
+def get_local_zone():
+    """
+    :return: ZoneTable for the configured time zone or the local zone of the machine
+    """
+    name = config.get(CONFIG_TIMEZONE)
+    if not name:
+        zone = get_localzone()
+        name = getattr(zone, 'zone', None) or getattr(zone, 'key', None) or str(zone)
+    try:
+        return ZoneTable(name)
+    except ValueError as exc:
+        logger.error("obs {}, falling back to UTC".format(exc))
+        return ZoneTable("UTC")
+
+LOCAL_ZONE = get_local_zone()
+
+def parse_utc(value):
+    """
+    Parse an obs-api dateTime (ISO-8601 in UTC without zone, e.g.
+    2018-05-22T08:00:00.0000000) by slicing, other formats go to dateutil
+    :return: aware datetime in UTC
+    """
+    try:
+        if len(value) >= 19 and value[4] == '-' and value[7] == '-' and value[10] == 'T' \
+                and value[13] == ':' and value[16] == ':':
+            rest = value[19:]
+            micro = 0
+            if rest.startswith('.'):
+                digits = rest[1:].rstrip('Z')
+                if digits.isdigit():
+                    micro = int(digits[:6].ljust(6, '0'))
+                    rest = rest[1 + len(digits):]
+            if rest in ('', 'Z'):
+                return datetime(int(value[0:4]), int(value[5:7]), int(value[8:10]),
+                                int(value[11:13]), int(value[14:16]), int(value[17:19]), micro, UTC)
+    except ValueError:
+        pass
+
+    parsed = parse(value)
+    if parsed.tzinfo is None:
+        return parsed.replace(tzinfo=UTC)
+    return parsed.astimezone(UTC)
+
+class ScheduleFetcher(threading.Thread):
+    """
+    Background worker that downloads and parses the obs-api booking feed,
+    only the finished booking list is handed back to the GTK main loop
+    """
+    def __init__(self, _logger, _url, _callback, timeout=DEFAULT_SCHEDULE_TIMEOUT, cache=None):
+        threading.Thread.__init__(self, name="obs-schedule")
+        self.setDaemon(True)
+
+        self.__logger = _logger
+        self.__callback = _callback
+        self.__wakeup = threading.Event()
+        self.url = _url
+        self.timeout = timeout
+        self.cache = cache
+
+        # validators of the last booking list we parsed
+        self.etag = None
+        self.last_modified = None
+
+    def fetch(self):
+        """
+        Request a new schedule, returns immediately
+        """
+        self.__wakeup.set()
+
+    def load_cached(self):
+        """
+        Parse the schedule stored by the last successful fetch and reuse its
+        validators, so a warm start with an unchanged feed is answered by a 304
+        :return: BookingIndex or None without a usable cache
+        """
+        if self.cache is None:
+            return None
+
+        entry = self.cache.load()
+        if entry is None:
+            return None
+
+        try:
+            bookings = parse_bookings(entry['feed'])
+        except Exception as exc:
+            self.__logger.warning("Ignoring obs schedule cache: {}".format(exc))
+            return None
+
+        self.etag = entry.get('etag')
+        self.last_modified = entry.get('last_modified')
+        self.__logger.info("Loaded {} cached obs bookings".format(len(bookings)))
+        return bookings
+
+    def run(self):
+        while True:
+            self.__wakeup.wait()
+            self.__wakeup.clear()
+
+            try:
+                bookings = self.get_bookings()
+            except Exception as exc:
+                self.__logger.warning("Could not get obs schedule from {}: {}".format(self.url, exc))
+                continue
+
+            if bookings is not None:
+                GLib.idle_add(self.__callback, bookings)
+
+    def get_bookings(self):
+        """
+        Download the booking feed, using the validators of the previous
+        response so an unchanged feed is neither transferred nor parsed again
+        :return: BookingIndex or None if the request failed
+                 or the feed was not modified (the last parsed schedule still applies)
+        """
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+
+        my_response = requests.get(self.url, headers=headers, timeout=self.timeout)
+        if my_response.status_code == 304:
+            self.__logger.debug("obs schedule not modified")
+            return None
+
+        if not my_response.ok:
+            self.__logger.warning("obs schedule request returned {}".format(my_response.status_code))
+            return None
+
+        bookings = parse_bookings(my_response.text)
+
+        # only remember the validators once the body was parsed successfully
+        self.etag = my_response.headers.get('ETag')
+        self.last_modified = my_response.headers.get('Last-Modified')
+        self.__logger.info("obs schedule modified")
+
+        if self.cache is not None:
+            self.cache.save(my_response.text, self.etag, self.last_modified)
+        return bookings
+
+class SchedulePushClient(threading.Thread):
+    """
+    Subscribes to a Server-Sent-Events stream of booking updates and applies
+    them to the in-memory schedule. Understood events:
+
+        schedule          data is the full booking feed (sent on every connect)
+        booking           data is one booking, added or replacing the one with the same id
+        booking-removed   data is {"id": ...} of a booking that was deleted
+
+    While disconnected the plugin falls back to polling the obs-api.
+    """
+    def __init__(self, _logger, _url, _callback, timeout=DEFAULT_PUSH_TIMEOUT, cache=None,
+                 connect_timeout=DEFAULT_SCHEDULE_TIMEOUT):
+        threading.Thread.__init__(self, name="obs-schedule-push")
+        self.setDaemon(True)
+
+        self.__logger = _logger
+        self.__callback = _callback
+        self.url = _url
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.cache = cache
+
+        self.connected = False
+        self.last_event_id = None
+        self.retry = 1
+        # BookingIndex the partial updates apply to, kept current by the plugin
+        self.current = BookingIndex()
+
+    def run(self):
+        while True:
+            try:
+                self.listen()
+            except Exception as exc:
+                self.__logger.warning("obs push stream {} dropped: {}".format(self.url, exc))
+            self.connected = False
+
+            sleep(self.retry)
+            self.retry = min(self.retry * 2, MAX_PUSH_RETRY)
+
+    def listen(self):
+        headers = {'Accept': 'text/event-stream', 'Cache-Control': 'no-cache'}
+        if self.last_event_id:
+            headers['Last-Event-ID'] = self.last_event_id
+
+        response = requests.get(self.url, headers=headers, stream=True, timeout=(self.connect_timeout, self.timeout))
+        try:
+            if not response.ok:
+                raise IOError("status code {}".format(response.status_code))
+
+            self.__logger.info("obs push stream connected to {}".format(self.url))
+            self.connected = True
+            self.retry = 1
+
+            event, data = None, []
+            for line in response.iter_lines(decode_unicode=True):
+                if not line:
+                    if data:
+                        self.handle_event(event or 'message', "\n".join(data))
+                    event, data = None, []
+                    continue
+
+                if line.startswith(':'):
+                    continue # heartbeat
+                field, _, value = line.partition(':')
+                if value.startswith(' '):
+                    value = value[1:]
+
+                if field == 'event':
+                    event = value
+                elif field == 'data':
+                    data.append(value)
+                elif field == 'id':
+                    self.last_event_id = value
+                elif field == 'retry' and value.isdigit():
+                    self.retry = max(int(value) // 1000, 1)
+        finally:
+            response.close()
+
+        raise IOError("stream closed by the server")
+
+    def handle_event(self, event, data):
+        if event == 'schedule':
+            bookings = parse_bookings(data)
+            if self.cache is not None:
+                self.cache.save(data)
+        elif event == 'booking':
+            booking = Booking.from_dict(json.loads(data))
+            bookings = BookingIndex([b for b in self.current if b.key() != booking.key()] + [booking])
+        elif event == 'booking-removed':
+            key = json.loads(data).get('id')
+            bookings = BookingIndex([b for b in self.current if b.key() != key])
         else:
-            return timedelta(0)
-    def tzname(self,dt):
-        return "GMT +2"
+            self.__logger.debug("Ignoring obs push event {}".format(event))
+            return
+
+        self.current = bookings
+        GLib.idle_add(self.__callback, bookings)
+
+class ScheduleCache():
+    """
+    Versioned on-disk copy of the last good obs-api booking feed
+    """
+    def __init__(self, _logger, _path):
+        self.__logger = _logger
+        self.path = _path
+
+    def load(self):
+        """
+        :return: dict with the raw feed and its validators or None if there is no usable cache
+        """
+        try:
+            with open(self.path, "r") as cacheFile:
+                entry = json.load(cacheFile)
+        except (IOError, OSError):
+            return None
+        except ValueError as exc:
+            self.__logger.warning("Corrupt obs schedule cache {}: {}".format(self.path, exc))
+            return None
+
+        if not isinstance(entry, dict) or entry.get('version') != SCHEDULE_CACHE_VERSION:
+            self.__logger.info("Ignoring obs schedule cache with unknown version")
+            return None
+        return entry
+
+    def save(self, feed, etag=None, last_modified=None):
+        """
+        Atomically replace the cache: write to a temporary file in the same
+        directory and rename it over the old one
+        """
+        entry = {
+            'version': SCHEDULE_CACHE_VERSION,
+            'etag': etag,
+            'last_modified': last_modified,
+            'feed': feed
+        }
+
+        directory = os.path.dirname(self.path) or "."
+        tmp_path = None
+        try:
+            fd, tmp_path = tempfile.mkstemp(prefix=".obs_schedule", dir=directory)
+            with os.fdopen(fd, "w") as tmpFile:
+                json.dump(entry, tmpFile)
+                tmpFile.flush()
+                os.fsync(tmpFile.fileno())
+            os.rename(tmp_path, self.path)
+        except (IOError, OSError) as exc:
+            self.__logger.warning("Could not write obs schedule cache {}: {}".format(self.path, exc))
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+class TransitionScheduler():
+    """
+    Keeps a single one-shot GLib timeout armed for the next session boundary
+    (start or end of a booking), GLib timeouts run on the monotonic clock
+    """
+    def __init__(self, _logger, _callback):
+        self.__logger = _logger
+        self.__callback = _callback
+        self.__source = None
+        # GLib monotonic time (us) at which the armed timeout fires
+        self.deadline = None
+
+    def arm(self, bookings, now):
+        """
+        (Re)arm the timeout for the first boundary after now
+        :param bookings: BookingIndex of the current schedule
+        :param now: aware datetime the schedule was evaluated at
+        """
+        self.cancel()
+
+        boundary = next_boundary(bookings, now)
+        if boundary is None:
+            self.__logger.info("no upcoming session boundary")
+            return
+
+        delay = int(math.ceil((boundary - now).total_seconds() * 1000))
+        delay = min(max(delay, 0) + 1, MAX_TRANSITION_DELAY)
+        self.deadline = GLib.get_monotonic_time() + delay * 1000
+        self.__source = GLib.timeout_add(delay, self.__fire)
+        self.__logger.info("next session boundary at {} (in {} ms)".format(boundary, delay))
+
+    def cancel(self):
+        if self.__source is not None:
+            GLib.source_remove(self.__source)
+        self.__source = None
+        self.deadline = None
+
+    def __fire(self):
+        self.__source = None
+        self.deadline = None
+        self.__callback()
+        return False
+
+def next_boundary(bookings, now):
+    """
+    :return: the earliest of the current booking end and the next booking start, or None
+    """
+    boundaries = []
+    current = bookings.current(now)
+    if current is not None:
+        boundaries.append(current.end)
+    upcoming = bookings.next(now)
+    if upcoming is not None:
+        boundaries.append(upcoming.start)
+    return min(boundaries) if boundaries else None
+
+def get_schedule_cache_path():
+    path = config.get(CONFIG_SCHEDULE_CACHE)
+    if path:
+        return path
+    return repo.get_attach_path(DEFAULT_SCHEDULE_CACHE)
+
+def parse_bookings(feed):
+    """
+    Parse the obs-api booking feed
+    :param feed: JSON text as returned by the obs-api
+    :return: BookingIndex over the valid bookings in the feed
+    """
+    bookings = []
+    for d in json.loads(feed):
+        try:
+            bookings.append(Booking.from_dict(d))
+        except (ValueError, TypeError, KeyError, AttributeError) as exc:
+            logger.warning("Skipping invalid obs booking: {}".format(exc))
+    return BookingIndex(bookings)
+
+class Organizer(object):
+    """
+    Organizer of a booking as given in the obs-api feed
+    """
+    __slots__ = ('name', 'email')
+
+    def __init__(self, name, email):
+        self.name = name
+        self.email = email
+
+    @classmethod
+    def from_dict(cls, d):
+        address = (d or {}).get('emailAddress') or {}
+        return cls(address.get('name') or '', address.get('address') or '')
+
+    def __eq__(self, other):
+        return isinstance(other, Organizer) and self.name == other.name and self.email == other.email
+
+    def __ne__(self, other):
+        return not self == other
+
+class Booking(object):
+    """
+    A single obs-api booking, validated once when the schedule changes
+    """
+    __slots__ = ('id', 'subject', 'start', 'end', 'series', 'series_title', 'organizer')
+
+    def __init__(self, id, subject, start, end, series, series_title, organizer):
+        self.id = id
+        self.subject = subject
+        self.start = start
+        self.end = end
+        self.series = series
+        self.series_title = series_title
+        self.organizer = organizer
+
+    @classmethod
+    def from_dict(cls, d):
+        """
+        Build a booking from a decoded obs-api event
+        :raise ValueError: if the event has no usable start and end
+        """
+        start = parse_utc(d['start']['dateTime'])
+        end = parse_utc(d['end']['dateTime'])
+        if not start < end:
+            raise ValueError("booking ends before it starts: {}".format(d.get('subject')))
+
+        return cls(d.get('id'), d.get('subject'), start, end,
+                   d.get('ocSeries'), d.get('ocSeriesTitle'), Organizer.from_dict(d.get('organizer')))
+
+    def key(self):
+        """
+        :return: identity of the booking across schedule updates
+        """
+        if self.id:
+            return self.id
+        return (self.start, self.subject, self.organizer.email)
+
+    def details(self):
+        """
+        :return: the details dictionary used to create the mediapackage of this booking
+        """
+        return {
+            'series': self.series,
+            'seriesTitle': self.series_title,
+            'title': self.subject,
+            'organizer': self.organizer.name,
+            'organizerEmail': self.organizer.email,
+            'take': 0
+        }
+
+    def __eq__(self, other):
+        return isinstance(other, Booking) and all(getattr(self, k) == getattr(other, k) for k in self.__slots__)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "<Booking {} {} - {}>".format(self.id, self.start, self.end)
+
+def same_booking(a, b):
+    """
+    :return: True if both are None or are the same booking (possibly with changed content)
+    """
+    if a is None or b is None:
+        return a is b
+    return a.key() == b.key()
+
+def diff_bookings(old, new):
+    """
+    Compare two schedules by booking key
+    :return: (added, changed, removed) lists of Booking
+    """
+    previous = dict((b.key(), b) for b in old)
+    added = []
+    changed = []
+    for booking in new:
+        before = previous.pop(booking.key(), None)
+        if before is None:
+            added.append(booking)
+        elif before != booking:
+            changed.append(booking)
+    return added, changed, list(previous.values())
+
+class BookingIndex():
+    """
+    Bookings sorted by start time, built once per schedule change so the
+    current and next booking are found with a bisect instead of a scan
+    """
+    def __init__(self, bookings=None):
+        """
+        :param bookings: iterable of Booking
+        """
+        self.bookings = sorted(bookings or [], key=lambda b: b.start)
+        self.starts = [b.start for b in self.bookings]
+
+        # running maximum of the end times, bookings before the first index
+        # whose max end is in the past can't be current any more
+        self.max_ends = []
+        for b in self.bookings:
+            self.max_ends.append(max(b.end, self.max_ends[-1]) if self.max_ends else b.end)
+
+    def __len__(self):
+        return len(self.bookings)
+
+    def __iter__(self):
+        return iter(self.bookings)
+
+    def current(self, now):
+        """
+        :return: the booking with start < now < end that started last, or None
+        """
+        i = bisect_left(self.starts, now) - 1
+        while i >= 0 and self.max_ends[i] > now:
+            if self.bookings[i].end > now:
+                return self.bookings[i]
+            i -= 1
+        return None
+
+    def next(self, now):
+        """
+        :return: the first booking starting after now, or None
+        """
+        i = bisect_right(self.starts, now)
+        if i < len(self.bookings):
+            return self.bookings[i]
+        return None
 
 class PowerMateWheel():
     def __init__(self, device=None):
@@ -600,13 +1388,562 @@ def find_wheels():
 
     return wheels
 
+def get_user_info(client, user_id, series_filter, _logger, cancel=None):
+    """
+    Retreive user and series info from Opencast, both requests run concurrently
+    :param cancel: optional threading.Event that aborts the requests
+    :return: dictionary structured content to set display name and series
+    """
+    result_data = {'fullname': '', 'email': '', 'username': '', 'site_id' : '', 'ocSeries' : [],
+                   'ca_name': client.hostname}
+
+    user, series = client.get_user_details_and_personal_series(user_id, series_filter, cancel)
+    if cancel is not None and cancel.is_set():
+        return result_data
+    result_data.update(parse_user_details(user, user_id, _logger))
+    result_data['ocSeries'] = parse_personal_series(series, user_id, _logger)
+    # Opencast answered that there is no such user, as opposed to failing to answer
+    body, error = user
+    result_data['not_found'] = not result_data['fullname'] and (
+        error is None or getattr(error, 'status_code', None) == 404)
+    return result_data
+
+def get_personal_series(client, user_id, series_filter, _logger):
+    """
+    :return: list of personal series of the user (External API series objects)
+    """
+    try:
+        result = (client.get_personal_series(user_id, series_filter), None)
+    except Exception as exc:
+        result = (None, exc)
+    return parse_personal_series(result, user_id, _logger)
+
+def parse_user_details(result, user_id, _logger):
+    """
+    :param result: (body, error) of the get_user_details request
+    :return: dict with fullname, email, username and upperuser or an empty dict if not found
+    """
+    response, error = result
+    try:
+        if error is not None:
+            raise error
+        full_data = json.loads(response, encoding='utf8')
+
+        if full_data['user']['name']:
+            return {
+                'fullname': full_data['user']['name'],
+                'email': full_data['user']['email'].lower(),
+                'username': full_data['user']['username'].lower(),
+                'upperuser': full_data['user']['username'].upper()
+            }
+
+    except Exception as exc:
+        _logger.warning('call_get_user_info user [{1}]: {0}'.format(exc, user_id))
+    return {}
+
+def parse_personal_series(result, user_id, _logger):
+    """
+    :param result: (body, error) of the get_personal_series request
+    :return: list of personal series of the user (External API series objects)
+    """
+    response, error = result
+    try:
+        if error is not None:
+            raise error
+
+        if "Personal Series" in response:
+            series_data = json.loads(response, encoding='utf8')
+
+            if len(series_data) > 0:
+                return series_data
+
+    except Exception as exc:
+        _logger.error('call_get_user_info series [{1}]: {0}'.format(exc, user_id))
+    return []
+
+class UserInfoCache():
+    """
+    Thread safe LRU store of resolved user info, keyed by the normalized user id.
+    Entries expire after a TTL that depends on what was found: users with a
+    personal series, users without one (it may be created at any time) and
+    user ids that were not found at all.
+    """
+    def __init__(self, size=DEFAULT_USER_CACHE_SIZE, series_ttl=DEFAULT_SERIES_CACHE_TTL,
+                 user_ttl=DEFAULT_USER_CACHE_TTL, negative_ttl=DEFAULT_NEGATIVE_CACHE_TTL):
+        self.size = size
+        self.series_ttl = series_ttl
+        self.user_ttl = user_ttl
+        self.negative_ttl = negative_ttl
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+
+    @staticmethod
+    def normalize(user_id):
+        return (user_id or '').strip().lower()
+
+    def ttl(self, info):
+        if not info.get('fullname'):
+            return self.negative_ttl
+        return self.series_ttl if info.get('ocSeries') else self.user_ttl
+
+    def __lookup(self, key, now):
+        entry = self.__entries.get(key)
+        if entry is not None and entry[0] <= now:
+            del self.__entries[key]
+            self.__dropped(key, entry[1])
+            self.expired += 1
+            entry = None
+        return entry
+
+    def __dropped(self, key, info):
+        # only the users that are still cached are suggested while typing
+        if self.normalize(info.get('username')) == key:
+            user_ids.discard(key)
+
+    def get(self, user_id):
+        key = self.normalize(user_id)
+        with self.__lock:
+            entry = self.__lookup(key, time.time())
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            # most recently used last
+            del self.__entries[key]
+            self.__entries[key] = entry
+            return entry[1]
+
+    def peek(self, user_id):
+        """ Like get, without counting it or changing the LRU order """
+        with self.__lock:
+            entry = self.__lookup(self.normalize(user_id), time.time())
+            return entry[1] if entry is not None else None
+
+    def put(self, user_id, info):
+        key = self.normalize(user_id)
+        with self.__lock:
+            previous = self.__entries.pop(key, None)
+            if previous is not None:
+                self.__dropped(key, previous[1])
+            self.__entries[key] = (time.time() + self.ttl(info), info)
+            while len(self.__entries) > self.size:
+                evicted = self.__entries.popitem(last=False)
+                self.__dropped(evicted[0], evicted[1][1])
+                self.evictions += 1
+        if info.get('fullname') and info.get('username'):
+            user_ids.add(info['username'])
+
+    def remove(self, user_id):
+        key = self.normalize(user_id)
+        with self.__lock:
+            entry = self.__entries.pop(key, None)
+            if entry is not None:
+                self.__dropped(key, entry[1])
+
+    def stats(self):
+        with self.__lock:
+            return {'entries': len(self.__entries), 'hits': self.hits, 'misses': self.misses,
+                    'expired': self.expired, 'evictions': self.evictions}
+
+    def __contains__(self, user_id):
+        with self.__lock:
+            return self.__lookup(self.normalize(user_id), time.time()) is not None
+
+class UserIdIndex():
+    """
+    Thread safe sorted list of the usernames in the user cache (recently looked
+    up or prefetched), for prefix completion with bisect. The user directory is
+    only used for exact lookups, so typing a few characters on a shared kiosk
+    does not list the names of everyone in the institution.
+    """
+    def __init__(self):
+        self.__ids = []
+        self.__lock = threading.Lock()
+
+    def add(self, user_id):
+        user_id = UserInfoCache.normalize(user_id)
+        with self.__lock:
+            i = bisect_left(self.__ids, user_id)
+            if i == len(self.__ids) or self.__ids[i] != user_id:
+                self.__ids.insert(i, user_id)
+
+    def discard(self, user_id):
+        user_id = UserInfoCache.normalize(user_id)
+        with self.__lock:
+            i = bisect_left(self.__ids, user_id)
+            if i < len(self.__ids) and self.__ids[i] == user_id:
+                del self.__ids[i]
+
+    def complete(self, prefix, limit=TYPEAHEAD_SUGGESTIONS):
+        """
+        :return: up to limit user ids starting with prefix, in order
+        """
+        prefix = UserInfoCache.normalize(prefix)
+        with self.__lock:
+            i = bisect_left(self.__ids, prefix)
+            matches = []
+            while i < len(self.__ids) and len(matches) < limit and self.__ids[i].startswith(prefix):
+                matches.append(self.__ids[i])
+                i += 1
+            return matches
+
+user_ids = UserIdIndex()
+
+user_cache = UserInfoCache(int(config.get(CONFIG_USER_CACHE_SIZE, DEFAULT_USER_CACHE_SIZE)),
+                           int(config.get(CONFIG_SERIES_CACHE_TTL, DEFAULT_SERIES_CACHE_TTL)),
+                           int(config.get(CONFIG_USER_CACHE_TTL, DEFAULT_USER_CACHE_TTL)),
+                           int(config.get(CONFIG_NEGATIVE_CACHE_TTL, DEFAULT_NEGATIVE_CACHE_TTL)))
+
+class MediapackageIngester(threading.Thread):
+    """
+    Ingests the recordings straight from the repository with the chunked or
+    streaming ingest of the Opencast client, as soon as the recorder stops.
+    Failed ingests are tried again a few times; a chunked one resumes from
+    the last chunk the server received.
+    """
+    def __init__(self, _logger, _client):
+        threading.Thread.__init__(self, name="obs-ingest")
+        self.setDaemon(True)
+
+        self.__logger = _logger
+        self.__client = _client
+        # (time to ingest, mp id, attempt)
+        self.__queue = []
+        self.__lock = threading.Lock()
+        self.__wakeup = threading.Event()
+        # last progress step reported of each mediapackage
+        self.__reported = {}
+        self.__client.ingest_progress = self.progress
+
+    def handle_recorder_stopped(self, origin, mp_id):
+        self.enqueue(mp_id)
+
+    def enqueue(self, mp_id, delay=0, attempt=1):
+        with self.__lock:
+            self.__queue.append((time.time() + delay, mp_id, attempt))
+            self.__queue.sort()
+        self.__wakeup.set()
+
+    def run(self):
+        while True:
+            with self.__lock:
+                due = self.__queue[0][0] - time.time() if self.__queue else None
+                if due is not None and due <= 0:
+                    start, mp_id, attempt = self.__queue.pop(0)
+            if due is None or due > 0:
+                self.__wakeup.wait(due)
+                self.__wakeup.clear()
+                continue
+            self.ingest(mp_id, attempt)
+
+    def ingest(self, mp_id, attempt):
+        mp = repo.get(mp_id)
+        if mp is None:
+            self.__logger.warning("Not ingesting {}, it is not in the repository".format(mp_id))
+            return
+
+        self.__logger.info("Ingesting MP {} (attempt {} of {})".format(mp_id, attempt, INGEST_ATTEMPTS))
+        mp.setOpStatus('ingest', mediapackage.OP_PROCESSING)
+        repo.update(mp)
+        try:
+            self.__client.ingest_mediapackage(mp)
+        except Exception as exc:
+            self.__logger.error("Ingest of MP {} failed: {}".format(mp_id, exc))
+            if attempt < INGEST_ATTEMPTS:
+                mp.setOpStatus('ingest', mediapackage.OP_PENDING)
+                self.enqueue(mp_id, INGEST_RETRY, attempt + 1)
+            else:
+                mp.setOpStatus('ingest', mediapackage.OP_FAILED)
+        else:
+            self.__logger.info("Ingested MP {}".format(mp_id))
+            mp.setOpStatus('ingest', mediapackage.OP_DONE)
+        self.__reported.pop(mp_id, None)
+        repo.update(mp)
+
+    def progress(self, mp_id, sent, total):
+        step = sent * 100 // total // INGEST_PROGRESS_STEP * INGEST_PROGRESS_STEP if total else 100
+        if step <= self.__reported.get(mp_id, -1):
+            return
+        self.__reported[mp_id] = step
+        self.__logger.info("Ingest of MP {}: {}% ({} of {} bytes)".format(mp_id, step, sent, total))
+        GLib.idle_add(dispatcher.emit, 'obs-ingest-progress', {'mp_id': mp_id, 'sent': sent, 'total': total})
+
+class UserPrefetcher(threading.Thread):
+    """
+    Resolves the Opencast user and personal series of the organizers of
+    today's bookings ahead of their sessions, into the user cache
+    """
+    def __init__(self, _logger, _client, series_filter):
+        threading.Thread.__init__(self, name="obs-user-prefetch")
+        self.setDaemon(True)
+
+        self.__logger = _logger
+        self.__client = _client
+        self.series_filter = series_filter
+        self.__pending = []
+        # organizer e-mails that could not be resolved, by the time they were tried
+        self.__tried = {}
+        self.__lock = threading.Lock()
+        self.__wakeup = threading.Event()
+
+    def prefetch(self, bookings, now):
+        """
+        Queue the organizers of the bookings that are still to come today, returns immediately
+        :param bookings: BookingIndex of the current schedule
+        :param now: aware datetime
+        """
+        today = now.astimezone(LOCAL_ZONE).date()
+        organizers = [b.organizer for b in bookings
+                      if b.end > now and b.start.astimezone(LOCAL_ZONE).date() == today
+                      and b.organizer.email and b.organizer.email not in user_cache]
+
+        with self.__lock:
+            retry = time.time() - user_cache.negative_ttl
+            self.__tried = dict((e, t) for e, t in self.__tried.items() if t >= retry)
+            organizers = [o for o in organizers if self.__tried.get(o.email, 0) < retry]
+            if not organizers:
+                return
+            self.__pending = organizers
+        self.__wakeup.set()
+
+    def run(self):
+        while True:
+            self.__wakeup.wait()
+            self.__wakeup.clear()
+
+            with self.__lock:
+                organizers, self.__pending = self.__pending, []
+
+            for organizer in organizers:
+                if organizer.email in user_cache:
+                    continue
+                try:
+                    self.resolve(organizer)
+                except Exception as exc:
+                    self.__logger.warning("Could not prefetch user {}: {}".format(organizer.email, exc))
+
+    def resolve(self, organizer):
+        """
+        Personal series are found by the organizer e-mail, the Opencast
+        username is the contributor of that series that is not the full name.
+        Only users Opencast confirmed are cached, the booking organizer is not
+        enough to offer (or create) a personal series for.
+        """
+        series = get_personal_series(self.__client, organizer.email, self.series_filter, self.__logger)
+
+        username = None
+        for contributor in (series[0].get('contributors') or []) if series else []:
+            if contributor and contributor != organizer.name:
+                username = contributor
+                break
+
+        info = None
+        if username:
+            info = get_user_info(self.__client, username, self.series_filter, self.__logger)
+            if info['fullname'] or info.get('not_found'):
+                user_cache.put(username, info)
+
+        if not info or not info['fullname']:
+            with self.__lock:
+                self.__tried[organizer.email] = time.time()
+            self.__logger.info("Could not prefetch user {} ({})".format(organizer.email, username))
+            return
+
+        user_cache.put(organizer.email, info)
+        self.__logger.info("Prefetched user {} ({})".format(organizer.email, username))
+
+class UserDirectory():
+    """
+    Read only, memory mapped snapshot of the Opencast users and their
+    personal series, with a hash index on the username and the e-mail.
+
+    File layout (little endian): header (magic, version, slots, users),
+    slots * u32 offsets of key entries (0 for an empty slot, linear probing
+    from crc32(key) % slots), key entries (u16 length, key, u32 offset of the
+    user record) and user records (u32 length, JSON).
+    """
+    HEADER = struct.Struct('<4sIII')
+    SLOT = struct.Struct('<I')
+    KEY = struct.Struct('<H')
+
+    def __init__(self, _logger, path):
+        self.__logger = _logger
+        self.path = path
+        # (mmap, slots, users), replaced as a whole when a new snapshot is loaded
+        self.__index = (None, 0, 0)
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'rb') as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (IOError, OSError, ValueError) as exc:
+            self.__logger.info("No user directory snapshot in {}: {}".format(self.path, exc))
+            return False
+
+        try:
+            magic, version, slots, users = self.HEADER.unpack_from(data, 0)
+        except struct.error:
+            self.__logger.warning("Ignoring user directory {}, truncated".format(self.path))
+            return False
+        if magic != USER_DIRECTORY_MAGIC or version != USER_DIRECTORY_VERSION:
+            self.__logger.warning("Ignoring user directory {}, unknown format".format(self.path))
+            return False
+        if len(data) < self.HEADER.size + slots * self.SLOT.size:
+            self.__logger.warning("Ignoring user directory {}, truncated".format(self.path))
+            return False
+        self.__index = (data, slots, users)
+        self.__logger.info("Loaded user directory {} ({} users)".format(self.path, users))
+        return True
+
+    def __len__(self):
+        return self.__index[2]
+
+    def get(self, user_id):
+        """
+        :return: the user info dict (as get_user_info) of a username or e-mail, None if not in the snapshot
+        """
+        data, slots, users = self.__index
+        if not slots:
+            return None
+        try:
+            # the text typed in GTK is a utf-8 str on Python 2
+            if isinstance(user_id, bytes):
+                user_id = user_id.decode('utf-8')
+            key = UserInfoCache.normalize(user_id).encode('utf-8')
+        except UnicodeError:
+            return None
+        slot = crc32(key) % slots
+        try:
+            # a valid table always has an empty slot, a corrupt one must not be probed forever
+            for probe in range(slots):
+                offset = self.SLOT.unpack_from(data, self.HEADER.size + slot * self.SLOT.size)[0]
+                if not offset:
+                    return None
+                length = self.KEY.unpack_from(data, offset)[0]
+                start = offset + self.KEY.size
+                if data[start:start + length] == key:
+                    record = self.SLOT.unpack_from(data, start + length)[0]
+                    length = self.SLOT.unpack_from(data, record)[0]
+                    start = record + self.SLOT.size
+                    return json.loads(data[start:start + length].decode('utf-8'))
+                slot = (slot + 1) % slots
+        except (struct.error, ValueError) as exc:
+            self.__logger.warning("Corrupt user directory {}: {}".format(self.path, exc))
+        return None
+
+    @classmethod
+    def write(cls, path, users):
+        """
+        Atomically replace the snapshot at path
+        :param users: list of user info dicts, indexed by their username and email
+        """
+        records = []
+        keys = []
+        offset = 0
+        for info in users:
+            record = json.dumps(info, separators=(',', ':')).encode('utf-8')
+            records.append(cls.SLOT.pack(len(record)) + record)
+            for key in set([info.get('username'), info.get('email')]):
+                if key:
+                    keys.append((UserInfoCache.normalize(key).encode('utf-8'), offset))
+            offset += len(records[-1])
+
+        slots = max(2 * len(keys), 1)
+        key_start = cls.HEADER.size + slots * cls.SLOT.size
+        key_entries = []
+        table = [0] * slots
+        position = key_start
+        for key, record_offset in keys:
+            slot = crc32(key) % slots
+            while table[slot]:
+                slot = (slot + 1) % slots
+            table[slot] = position
+            key_entries.append((key, record_offset))
+            position += cls.KEY.size + len(key) + cls.SLOT.size
+        record_start = position
+
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(cls.HEADER.pack(USER_DIRECTORY_MAGIC, USER_DIRECTORY_VERSION, slots, len(users)))
+                f.write(struct.pack('<%dI' % slots, *table))
+                for key, record_offset in key_entries:
+                    f.write(cls.KEY.pack(len(key)) + key + cls.SLOT.pack(record_start + record_offset))
+                for record in records:
+                    f.write(record)
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(tmp_path, path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+class UserDirectorySync(threading.Thread):
+    """
+    Rebuilds the user directory snapshot from the Opencast users and the
+    personal series, matched on the series contributors (see UserPrefetcher)
+    """
+    def __init__(self, _logger, _client, directory, series_filter, interval):
+        threading.Thread.__init__(self, name="obs-user-directory")
+        self.setDaemon(True)
+
+        self.__logger = _logger
+        self.__client = _client
+        self.directory = directory
+        # the personal series filter is appended to a text filter, here it is the only one
+        self.series_filter = re.sub('^(%2C|,)', '', series_filter, flags=re.IGNORECASE)
+        self.interval = interval
+
+    def run(self):
+        while True:
+            try:
+                self.sync()
+                sleep(self.interval)
+            except Exception as exc:
+                self.__logger.warning("Could not sync the user directory: {}".format(exc))
+                sleep(USER_DIRECTORY_RETRY)
+
+    def pages(self, fetch):
+        offset = 0
+        while True:
+            page = fetch(USER_DIRECTORY_PAGE, offset)
+            for item in page:
+                yield item
+            if len(page) < USER_DIRECTORY_PAGE:
+                return
+            offset += len(page)
+
+    def sync(self):
+        series_by_user = {}
+        for series in self.pages(lambda limit, offset: self.__client.get_series(self.series_filter, limit, offset)):
+            summary = {'identifier': series.get('identifier'), 'title': series.get('title')}
+            for contributor in series.get('contributors') or []:
+                series_by_user.setdefault(UserInfoCache.normalize(contributor), []).append(summary)
+
+        users = []
+        for user in self.pages(self.__client.get_users):
+            username = (user.get('username') or '').lower()
+            if not username or not user.get('name'):
+                continue
+            users.append({'fullname': user['name'], 'email': (user.get('email') or '').lower(),
+                          'username': username, 'upperuser': username.upper(), 'site_id': '',
+                          'ocSeries': series_by_user.get(username, []), 'ca_name': self.__client.hostname})
+
+        UserDirectory.write(self.directory.path, users)
+        self.directory.load()
+
 class SetUserClass(Gtk.Widget):
     """
-    Handle a pop up to select a user
+    Handle a pop up to select a user, built once and shown again with run()
     """
     __gtype_name__ = 'SetUserClass'
 
-    def __init__(self, _logger=None, title="Get My Info", client=None):
+    def __init__(self, _logger=None, title="Get My Info", client=None, directory=None):
         """
         """
         self.id = ""
@@ -615,10 +1952,20 @@ class SetUserClass(Gtk.Widget):
         self.series_id = ""
         self.series_title = ""
         self.searching = False
+        self.search_value = None
+        # bumped on every search and cancel, results of older searches are dropped
+        self.search_token = 0
+        self.search_cancel = None
+        self.search_timer = None
+        self.last_text = ""
         self.details = None
+        self.return_value = None
+        # time run() was called, until the first frame of the dialog is drawn
+        self.frame_start = None
 
         self.__logger = _logger
         self.__oc_client = client
+        self.directory = directory
 
         self.series_filter = config.get(CONFIG_SERIES_FILTER, DEFAULT_SERIES_FILTER)
 
@@ -646,9 +1993,6 @@ class SetUserClass(Gtk.Widget):
         self.dialog.set_modal(True)
         self.dialog.set_keep_above(False)
 
-        # user select button
-        self.user_button = Gtk.Button()
-
         #NEW HEADER
         strip = Header(size=size, title=title)
         self.dialog.vbox.pack_start(strip, True, True, 0)
@@ -661,6 +2005,7 @@ class SetUserClass(Gtk.Widget):
         #self.search_field.connect('stop-search', self.search_stopped)
 
         self.result = gui.get_object("grd_result")
+        self.build_results()
 
         if parent != None:
             # FIXME: The keyboard plugin uses Ubuntu Onboard.
@@ -678,13 +2023,124 @@ class SetUserClass(Gtk.Widget):
             for style_class in window_classes:
                 dialog_style_context.add_class(style_class)
 
-        self.dialog.show_all()
+        self.dialog.connect('draw', self.on_draw)
+        self.dialog.vbox.show_all()
+        self.show_result(None)
+
+    def build_results(self):
+        """
+        Create the widgets of every kind of result once, they are shown,
+        hidden and relabelled instead of being rebuilt for each search
+        """
+        # searching / creating the series
+        self.loading_box = Gtk.Box(spacing=10)
+        self.loading_box.set_name("grd_result_loading")
+        self.loading_box.pack_start(Gtk.Label(""), expand=False, fill=False, padding=0)
+        self.spinner = Gtk.Spinner()
+        self.loading_box.pack_start(self.spinner, expand=False, fill=False, padding=0)
+        self.loading_label = Gtk.Label("")
+        self.loading_box.pack_start(self.loading_label, expand=False, fill=False, padding=0)
+        self.loading_box.pack_start(Gtk.Label(""), expand=False, fill=False, padding=0)
+
+        # user found
+        self.result_box = Gtk.Box(spacing=30)
+        self.result_box.set_name("grd_result_button")
+        self.user_button = Gtk.Button()
+        self.user_button.set_name("btn_select_user")
+        self.user_button.set_relief(Gtk.ReliefStyle.NONE)
+        self.user_button.connect("clicked", self.select_user)
+        button_box = Gtk.Box(spacing=10)
+        self.user_button.add(button_box)
+        self.img_series = Gtk.Image()
+        button_box.pack_start(self.img_series, expand=False, fill=False, padding=10)
+        self.user_label = Gtk.Label("")
+        button_box.pack_start(self.user_label, expand=False, fill=False, padding=10)
+        label = Gtk.Label("select")
+        label.set_markup('<span foreground="#494941" face="sans" size="small">select</span>')
+        button_box.pack_start(label, expand=False, fill=False, padding=10)
+        self.result_box.pack_start(self.user_button, expand=True, fill=True, padding=10)
+
+        # no user found / error
+        self.message_box = Gtk.Box(spacing=10)
+        self.message_box.set_name("grd_result_loading")
+        self.message_box.pack_start(Gtk.Label(""), expand=False, fill=False, padding=0)
+        self.message_icon = Gtk.Image()
+        self.message_icon.set_from_icon_name("emblem-important", 5)
+        self.message_box.pack_start(self.message_icon, expand=False, fill=False, padding=8)
+        self.message_label = Gtk.Label("")
+        self.message_box.pack_start(self.message_label, expand=False, fill=False, padding=0)
+        self.message_box.pack_start(Gtk.Label(""), expand=False, fill=False, padding=0)
+
+        # type-ahead suggestions
+        self.suggestions = []
+        self.suggestion_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
+        for i in range(TYPEAHEAD_SUGGESTIONS):
+            button = Gtk.Button()
+            button.set_name("btn_suggest_user")
+            button.set_relief(Gtk.ReliefStyle.NONE)
+            label = Gtk.Label()
+            label.set_halign(Gtk.Align.START)
+            button.add(label)
+            button.connect("clicked", self.pick_suggestion, i)
+            self.suggestion_box.pack_start(button, expand=False, fill=False, padding=0)
+            self.suggestions.append([button, label, None])
+
+        for box in (self.loading_box, self.result_box, self.message_box, self.suggestion_box):
+            self.result.pack_start(box, expand=False, fill=False, padding=0)
+
+    def show_result(self, box):
+        """ Show one of the result boxes (None for an empty result area) """
+        for child in (self.loading_box, self.result_box, self.message_box, self.suggestion_box):
+            child.set_visible(child is box)
+        if box is self.loading_box:
+            self.spinner.start()
+        else:
+            self.spinner.stop()
+
+    def show_loading(self, text):
+        self.loading_label.set_text(text)
+        self.show_result(self.loading_box)
 
-        parent.get_style_context().add_class('shaded')
+    def show_message(self, text, error=False):
+        self.message_label.set_text(text)
+        self.message_icon.set_visible(error)
+        self.show_result(self.message_box)
+
+    def reset(self):
+        """ Forget the previous use of the dialog """
+        self.cancel_search()
+        self.id = ""
+        self.user_name = ""
+        self.user_email = ""
+        self.series_id = ""
+        self.series_title = ""
+        self.details = None
+        self.last_text = ""
+        self.search_field.set_text("")
+        self.user_button.set_sensitive(True)
+        self.show_result(None)
+
+    def run(self):
+        """
+        Show the dialog until a user is selected or it is closed
+        :return: the dialog response, -10 when a user was selected
+        """
+        self.reset()
+        self.frame_start = time.time()
+
+        self.par.get_style_context().add_class('shaded')
         self.return_value = self.dialog.run()
 
-        parent.get_style_context().remove_class('shaded')
-        self.dialog.destroy()
+        self.par.get_style_context().remove_class('shaded')
+        self.cancel_search()
+        self.dialog.hide()
+        return self.return_value
+
+    def on_draw(self, widget, cr):
+        if self.frame_start is not None:
+            self.__logger.info("Get My Info first frame after {:.1f} ms".format((time.time() - self.frame_start) * 1000))
+            self.frame_start = None
+        return False
 
     def on_key_release(self, widget, ev, data=None):
 
@@ -692,15 +2148,69 @@ class SetUserClass(Gtk.Widget):
         if ev.keyval == Gdk.KEY_Escape:
             widget.set_text("")
             self.clear_search_entry()
+            return
+
+        text = widget.get_text()
 
         # If Enter pressed, try searching
         if ev.keyval == Gdk.KEY_Return or ev.keyval == Gdk.KEY_KP_Enter:
-            self.do_search(widget.get_text())
+            self.last_text = text
+            self.do_search(text)
+            return
+
+        # Keys that do not change the text (shift, arrows...) change nothing
+        if text == self.last_text:
+            return
+        self.last_text = text
+
+        # Typing on makes the running search and the pending one stale
+        self.cancel_search()
+        self.show_suggestions(text)
+
+        if self.__regexp.match(text): # if valid search
+            self.__logger.info("found :) " + text)
+            if self.is_local(text):
+                self.do_search(text)
+            else:
+                # only look it up in Opencast once the typing pauses
+                self.search_timer = GLib.timeout_add(SEARCH_DEBOUNCE, self.debounced_search, text)
+
+    def debounced_search(self, text):
+        self.search_timer = None
+        if text == self.search_field.get_text():
+            self.do_search(text)
+        return False
+
+    def is_local(self, user_id):
+        return user_id in user_cache or (self.directory is not None and self.directory.get(user_id) is not None)
+
+    def show_suggestions(self, text):
+        """ List the recently seen (cached) users whose id starts with the typed text """
+        found = []
+        for user_id in user_ids.complete(text) if len(text.strip()) >= TYPEAHEAD_MIN_PREFIX else []:
+            info = user_cache.peek(user_id)
+            if info is not None and info.get('fullname'):
+                found.append((user_id, info['fullname']))
+
+        for i, suggestion in enumerate(self.suggestions):
+            button, label = suggestion[0], suggestion[1]
+            if i < len(found):
+                suggestion[2] = found[i][0]
+                label.set_markup('{} <span foreground="#494941" size="small">{}</span>'.format(
+                    GLib.markup_escape_text(found[i][1]), GLib.markup_escape_text(found[i][0])))
+            else:
+                suggestion[2] = None
+            button.set_visible(i < len(found))
 
-        if self.__regexp.match(widget.get_text()): # if valid search
-            self.__logger.info("found :) " + widget.get_text())
-            if not self.searching:
-                self.do_search(widget.get_text())
+        self.show_result(self.suggestion_box if found else None)
+
+    def pick_suggestion(self, button, index):
+        user_id = self.suggestions[index][2]
+        if user_id is None:
+            return
+        self.search_field.set_text(user_id)
+        self.last_text = user_id
+        self.do_search(user_id)
 
     def search_changed(self, widget, data=None):
         #self.__logger.info("search_changed")
@@ -719,132 +2229,116 @@ class SetUserClass(Gtk.Widget):
         self.searching = False
 
     def clear_search_entry(self):
-        self.searching = False
+        self.cancel_search()
+        self.last_text = ""
         self.search_field.set_text("")
-
-        for element in self.result.get_children():
-            self.result.remove(element)
-
-        label = Gtk.Label("")
-        self.result.pack_start(label, expand=False, fill=False, padding=0)
+        self.show_result(None)
+
+    def cancel_search(self):
+        """ Abort the running and the pending lookup, if any; their result will be dropped """
+        if self.search_timer is not None:
+            GLib.source_remove(self.search_timer)
+            self.search_timer = None
+        if self.search_cancel is not None:
+            self.search_cancel.set()
+            self.search_cancel = None
+        self.search_token += 1
+        self.searching = False
+        self.search_value = None
 
     def do_search(self, value):
         self.__logger.info("Searching for " + value)
+        self.cancel_search()
         self.searching = True
-        self.search_field.set_editable(False) # disabled
-
-        for element in self.result.get_children():
-            self.result.remove(element)
-
-        loading_box = Gtk.Box(spacing=10)
-        loading_box.set_name("grd_result_loading")
-
-        label = Gtk.Label("")
-        loading_box.pack_start(label, expand=False, fill=False, padding=0)
+        self.search_value = value
+        token = self.search_token
+        cancel = self.search_cancel = threading.Event()
 
-        spinner = Gtk.Spinner()
-        spinner.start()
-        loading_box.pack_start(spinner, expand=False, fill=False, padding=0)
+        self.show_loading(" Searching... ")
 
-        label = Gtk.Label(" Searching... ")
-        loading_box.pack_start(label, expand=False, fill=False, padding=0)
+        worker = threading.Thread(target=self.search_worker, args=(value, token, cancel))
+        worker.setDaemon(True)
+        worker.start()
 
-        label = Gtk.Label("")
-        loading_box.pack_start(label, expand=False, fill=False, padding=0)
-
-        self.result.pack_start(loading_box, expand=False, fill=False, padding=0)
-        self.result.show_all()
+    def search_worker(self, value, token, cancel):
+        """ Look a user up off the main loop and hand the result back to it """
+        try:
+            details = self.call_get_user_info(value, cancel)
+        except Exception as exc:
+            self.__logger.error('search for {}: {}'.format(value, exc))
+            details = {'fullname': ''}
+        if not cancel.is_set():
+            GLib.idle_add(self.deliver_search, token, details)
 
-        self.show_response( self.call_get_user_info(value) ) # static request
+    def deliver_search(self, token, details):
+        if token == self.search_token:
+            self.search_cancel = None
+            self.show_response(details)
+        return False
 
     def show_response(self, details):
         self.__logger.info("Got search results back")
 
-        for element in self.result.get_children():
-            self.result.remove(element)
-
         if details['fullname']:
             self.details = details
             self.id = details['username']
             self.user_name = details['fullname']
             self.user_email = details['email']
 
-            result_box = Gtk.Box(spacing=30)
-            result_box.set_name("grd_result_button")
-
-            self.user_button = Gtk.Button()
-            self.user_button.set_name("btn_select_user")
-            self.user_button.set_relief(Gtk.ReliefStyle.NONE)
-            button_box = Gtk.Box(spacing=10)
-            self.user_button.add(button_box)
-
             self.__logger.info("Found: " + details['fullname'])
-            label = Gtk.Label(details['fullname'])
-
-            img_series = Gtk.Image()
+            self.user_label.set_text(details['fullname'])
+            self.user_button.set_sensitive(True)
 
             if details['ocSeries']:
                 self.__logger.info("     Series: " + details['ocSeries'][0]['identifier'])
-                img_series.set_from_icon_name("object-select-symbolic", 2)
-                self.user_button.connect("clicked", self.close_modal)
+                self.img_series.set_from_icon_name("object-select-symbolic", 2)
                 self.series_id = details['ocSeries'][0]['identifier']
                 self.series_title = details['ocSeries'][0]['title']
             else:
-                img_series.set_from_icon_name("star-new-symbolic", 2)
-                self.user_button.connect("clicked", self.create_series)
+                self.img_series.set_from_icon_name("star-new-symbolic", 2)
                 self.series_id = ""
                 self.series_title = ""
 
-            button_box.pack_start(img_series, expand=False, fill=False, padding=10)
-            button_box.pack_start(label, expand=False, fill=False, padding=10)
-
-            label = Gtk.Label("select")
-            label.set_markup('<span foreground="#494941" face="sans" size="small">select</span>')
-            button_box.pack_start(label, expand=False, fill=False, padding=10)
-
-            result_box.pack_start(self.user_button, expand=True, fill=True, padding=10)
-            self.result.pack_start(result_box, expand=False, fill=False, padding=0)
+            self.show_result(self.result_box)
         else:
             self.__logger.info(":(")
             self.details = None
-            label = Gtk.Label("No student or lecturer found.")
-            self.result.pack_start(label, expand=False, fill=False, padding=0)
+            self.show_message("No student or lecturer found.")
 
         self.searching = False
-        self.search_field.set_editable(True) # enabled
-        self.result.show_all()
+        self.search_value = None
 
-    def create_series(self, ev=None):
-        conf = context.get_conf()
+    def select_user(self, button):
+        if self.series_id:
+            self.close_modal()
+        else:
+            self.create_series()
 
+    def create_series(self, ev=None):
         self.__logger.info("Creating series")
 
-        if self.user_button is not None:
-            self.user_button.set_sensitive(False) # disabled
-
-        for element in self.result.get_children():
-            self.result.remove(element)
-
-        loading_box = Gtk.Box(spacing=10)
-        loading_box.set_name("grd_result_loading")
-
-        label = Gtk.Label("")
-        loading_box.pack_start(label, expand=False, fill=False, padding=0)
+        self.user_button.set_sensitive(False) # disabled
+        self.cancel_search()
+        self.show_loading(" Creating user profile... ")
 
-        spinner = Gtk.Spinner()
-        spinner.start()
-        loading_box.pack_start(spinner, expand=False, fill=False, padding=0)
+        worker = threading.Thread(target=self.create_series_worker, args=(self.details, self.search_token))
+        worker.setDaemon(True)
+        worker.start()
 
-        label = Gtk.Label(" Creating user profile... ")
-        loading_box.pack_start(label, expand=False, fill=False, padding=0)
-
-        label = Gtk.Label("")
-        loading_box.pack_start(label, expand=False, fill=False, padding=0)
-
-        self.result.pack_start(loading_box, expand=False, fill=False, padding=0)
-        self.result.show_all()
+    def create_series_worker(self, details, token):
+        """ Create the series off the main loop, it may retry for a few seconds """
+        try:
+            resp = self.call_create_series(details)
+        except Exception as exc:
+            self.__logger.error('create series: {}'.format(exc))
+            resp = None
+        GLib.idle_add(self.deliver_series, token, resp)
 
-        self.set_series_close_modal(self.call_create_series(self.details))
+    def deliver_series(self, token, resp):
+        # dropped if the dialog was closed or a new search started meanwhile
+        if token == self.search_token:
+            self.set_series_close_modal(resp)
+        return False
 
     def set_series_close_modal(self, resp):
         self.__logger.info("POST request returned.")
@@ -856,38 +2350,18 @@ class SetUserClass(Gtk.Widget):
         else:
             self.series_id = ""
             self.series_title = ""
-
-            for element in self.result.get_children():
-                self.result.remove(element)
-
-            loading_box = Gtk.Box(spacing=10)
-            loading_box.set_name("grd_result_loading")
-
-            label = Gtk.Label("")
-            loading_box.pack_start(label, expand=False, fill=False, padding=0)
-
-            img_error = Gtk.Image()
-            img_error.set_from_icon_name("emblem-important", 5)
-            loading_box.pack_start(img_error, expand=False, fill=False, padding=8)
-
-            label = Gtk.Label("Could not create user profile")
-            loading_box.pack_start(label, expand=False, fill=False, padding=0)
-
-            label = Gtk.Label("")
-            loading_box.pack_start(label, expand=False, fill=False, padding=0)
-
-            self.result.pack_start(loading_box, expand=False, fill=False, padding=0)
-            self.result.show_all()
+            self.show_message("Could not create user profile", error=True)
 
     def close_modal(self, ev=None):
         self.__logger.info("closing modal")
         self.dialog.response(-10)
 
-    def call_get_user_info(self, user_id):
+    def call_get_user_info(self, user_id, cancel=None):
         """
         Retreive user and series info from Opencast
 
         :param id: Staff / T / Student Number
+        :param cancel: optional threading.Event that aborts the lookup
 
         :return: Return dictionary structured content to set display name and series
 
@@ -898,36 +2372,20 @@ class SetUserClass(Gtk.Widget):
         if not user_id:
             raise ValueError("user ID isn't set")
 
-        result_data = {'fullname': '', 'email': '', 'username': '', 'site_id' : '', 'ocSeries' : [],
-                       'ca_name': self.__oc_client.hostname}
-
-        try:
-            response = self.__oc_client.get_user_details(user_id)
-            full_data = json.loads(response, encoding='utf8')
-            # self.__logger.info(full_data)
-
-            if full_data['user']['name']:
-                result_data['fullname'] = full_data['user']['name']
-                result_data['email'] = full_data['user']['email'].lower()
-                result_data['username'] = full_data['user']['username'].lower()
-                result_data['upperuser'] = full_data['user']['username'].upper()
+        result_data = user_cache.get(user_id)
+        if result_data is not None:
+            self.__logger.info("Using cached user info for {} {}".format(user_id, user_cache.stats()))
+            return result_data
 
-        except Exception as exc:
-            self.__logger.warning('call_get_user_info user [{1}]: {0}'.format(exc, user_id))
-
-        try:
-            response = self.__oc_client.get_personal_series(user_id, self.series_filter)
-
-            if "Personal Series" in response:
-                series_data = json.loads(response, encoding='utf8')
-
-                if len(series_data) > 0:
-                    result_data['ocSeries'] = series_data
-
-        except Exception as exc:
-            self.__logger.error('call_get_user_info series [{1}]: {0}'.format(exc, user_id))
+        if self.directory is not None:
+            result_data = self.directory.get(user_id)
+            if result_data is not None:
+                self.__logger.info("Using the user directory for {}".format(user_id))
+                return result_data
 
-        # self.__logger.info(result_data)
+        result_data = get_user_info(self.__oc_client, user_id, self.series_filter, self.__logger, cancel)
+        if result_data['fullname'] or result_data.get('not_found'):
+            user_cache.put(user_id, result_data)
         return result_data
 
     def call_create_series(self, data):
@@ -952,12 +2410,19 @@ class SetUserClass(Gtk.Widget):
             m = METADATA.safe_substitute(data).encode('iso-8859-1')
             a = ACL.safe_substitute(data).encode('iso-8859-1')
 
-            response = self.__oc_client.create_series(m, a)
+            response = self.__oc_client.create_series(m, a, user_id=data.get('username'), filter=self.series_filter)
             if response is not None:
                 if "identifier" in response:
-                    details = json.loads(response, object_hook=lambda d: namedtuple('X', d.keys())(*d.values()))
-                    if details.identifier:
-                        result = details.identifier
+                    details = json.loads(response)
+                    if details.get('identifier'):
+                        result = details['identifier']
+
+                        # the cached info and the directory snapshot still say this user has no series
+                        info = dict(data)
+                        info['ocSeries'] = [{'identifier': result, 'title': details.get('title') or ''}]
+                        for key in (data.get('username'), data.get('email')):
+                            if key:
+                                user_cache.put(key, info)
 
         except Exception as exc:
             self.__logger.error('call_create_series: {}'.format(exc))
@@ -0,0 +1,67 @@
+"""
+Compare decoding the obs-api booking feed into per-object namedtuples (the
+old object_hook) with the slotted Booking records used by the obs plugin.
+
+Run from a Galicaster checkout with obs.py installed as a plugin:
+
+    python tests/booking_decode_bench.py [bookings] [rounds]
+"""
+import gc
+import json
+import sys
+import timeit
+
+from collections import namedtuple
+from datetime import datetime, timedelta
+from dateutil.parser import parse
+
+from galicaster.plugins.obs import Booking, parse_bookings
+
+
+def make_feed(count):
+    start = datetime(2018, 5, 22, 8, 0)
+    events = []
+    for i in range(count):
+        begin = start + timedelta(minutes=30 * i)
+        events.append({
+            'id': 'AAMkAGI2TG93AAA%06d' % i,
+            'subject': 'Booking %d' % i,
+            'start': {'dateTime': begin.strftime('%Y-%m-%dT%H:%M:%S.0000000'), 'timeZone': 'UTC'},
+            'end': {'dateTime': (begin + timedelta(minutes=25)).strftime('%Y-%m-%dT%H:%M:%S.0000000'), 'timeZone': 'UTC'},
+            'ocSeries': 'series-%d' % (i % 40),
+            'ocSeriesTitle': 'Personal Series (%d)' % (i % 40),
+            'organizer': {'emailAddress': {'name': 'Person %d' % (i % 40), 'address': 'person%d@uct.ac.za' % (i % 40)}}
+        })
+    return json.dumps(events)
+
+
+def decode_namedtuple(feed):
+    x = json.loads(feed, object_hook=lambda d: namedtuple('X', d.keys())(*d.values()))
+    return [(parse(line.start.dateTime + 'Z'), parse(line.end.dateTime + 'Z'), line) for line in x]
+
+
+def decode_booking(feed):
+    return parse_bookings(feed)
+
+
+def retained_objects(decode, feed):
+    """ Number of gc tracked objects kept alive by one decoded schedule """
+    gc.collect()
+    before = len(gc.get_objects())
+    result = decode(feed)
+    gc.collect()
+    after = len(gc.get_objects())
+    del result
+    return after - before
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    feed = make_feed(count)
+
+    print("{} bookings, {} rounds".format(count, rounds))
+    for name, decode in (('namedtuple', decode_namedtuple), ('Booking', decode_booking)):
+        seconds = min(timeit.repeat(lambda: decode(feed), number=rounds, repeat=3)) / rounds
+        print("{:>12}: {:8.2f} ms/decode {:8d} objects retained".format(
+            name, seconds * 1000, retained_objects(decode, feed)))
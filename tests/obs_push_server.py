@@ -0,0 +1,176 @@
+"""
+Local stand-in for the obs-api to try out the obs plugin without camonitor.
+
+    python tests/obs_push_server.py [port] [update interval]
+
+and point the plugin at it:
+
+    [obs]
+    url_schedule = http://localhost:8080/obs-api/event/
+    url_push = http://localhost:8080/obs-api/stream
+
+GET /obs-api/event/   booking feed with ETag / 304 handling (polling)
+GET /obs-api/stream   Server-Sent-Events: a "schedule" snapshot on connect, then a
+                      "booking" update every UPDATE_INTERVAL seconds and heartbeats
+POST /obs-api/drop    closes all open streams, to exercise the polling fallback
+"""
+import json
+import sys
+import threading
+import time
+
+from datetime import datetime, timedelta
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+UPDATE_INTERVAL = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+HEARTBEAT_INTERVAL = 15
+
+lock = threading.Lock()
+generation = [0]
+streams = []
+
+
+def booking(i, start, minutes=25):
+    return {
+        'id': 'standin-%d' % i,
+        'subject': 'Stand-in booking %d' % i,
+        'start': {'dateTime': start.strftime('%Y-%m-%dT%H:%M:%S.0000000'), 'timeZone': 'UTC'},
+        'end': {'dateTime': (start + timedelta(minutes=minutes)).strftime('%Y-%m-%dT%H:%M:%S.0000000'), 'timeZone': 'UTC'},
+        'ocSeries': 'standin-series-%d' % (i % 3),
+        'ocSeriesTitle': 'Personal Series (Stand-in %d)' % (i % 3),
+        'organizer': {'emailAddress': {'name': 'Stand-in %d' % (i % 3), 'address': 'standin%d@example.com' % (i % 3)}}
+    }
+
+
+now = datetime.utcnow().replace(second=0, microsecond=0)
+bookings = [booking(i, now + timedelta(minutes=30 * i - 5)) for i in range(8)]
+
+
+def public(b):
+    return dict((k, v) for k, v in b.items() if k != '_generation')
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path.startswith('/obs-api/event'):
+            self.send_feed()
+        elif self.path.startswith('/obs-api/stream'):
+            self.send_stream()
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        if self.path.startswith('/obs-api/drop'):
+            with lock:
+                for wfile in streams:
+                    try:
+                        wfile.close()
+                    except Exception:
+                        pass
+            self.send_response(204)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+        else:
+            self.send_error(404)
+
+    def send_feed(self):
+        with lock:
+            etag = '"%d"' % generation[0]
+            body = json.dumps([public(b) for b in bookings]).encode('utf-8')
+
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_chunk(self, text):
+        data = text.encode('utf-8')
+        self.wfile.write(('%x\r\n' % len(data)).encode('ascii') + data + b'\r\n')
+        self.wfile.flush()
+
+    def send_event(self, event, data, event_id=None):
+        message = 'event: %s\n' % event
+        if event_id is not None:
+            message += 'id: %s\n' % event_id
+        message += ''.join('data: %s\n' % line for line in data.split('\n'))
+        self.send_chunk(message + '\n')
+
+    def send_stream(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        with lock:
+            streams.append(self.wfile)
+            snapshot = json.dumps([public(b) for b in bookings])
+            seen = generation[0]
+
+        try:
+            self.send_chunk('retry: 2000\n\n')
+            self.send_event('schedule', snapshot, seen)
+            last_beat = time.time()
+            while True:
+                time.sleep(1)
+                with lock:
+                    changed = [b for b in bookings if b.get('_generation', 0) > seen]
+                    seen = generation[0]
+                for b in changed:
+                    self.send_event('booking', json.dumps(public(b)), seen)
+                if time.time() - last_beat > HEARTBEAT_INTERVAL:
+                    self.send_chunk(': heartbeat\n\n')
+                    last_beat = time.time()
+        except Exception:
+            pass
+        finally:
+            with lock:
+                if self.wfile in streams:
+                    streams.remove(self.wfile)
+
+    def log_message(self, format, *args):
+        sys.stderr.write("[obs stand-in] " + (format % args) + "\n")
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def change_bookings():
+    """ Move the end of a booking every UPDATE_INTERVAL seconds """
+    i = 0
+    while True:
+        time.sleep(UPDATE_INTERVAL)
+        with lock:
+            generation[0] += 1
+            b = bookings[i % len(bookings)]
+            end = datetime.strptime(b['end']['dateTime'][:19], '%Y-%m-%dT%H:%M:%S') + timedelta(minutes=1)
+            b['end']['dateTime'] = end.strftime('%Y-%m-%dT%H:%M:%S.0000000')
+            b['_generation'] = generation[0]
+        i += 1
+
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8080
+    updater = threading.Thread(target=change_bookings)
+    updater.setDaemon(True)
+    updater.start()
+    print("obs-api stand-in on http://localhost:%d/obs-api/" % port)
+    Server(('', port), Handler).serve_forever()
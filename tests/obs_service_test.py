@@ -1,25 +1,14 @@
 import json
-from datetime import timedelta, datetime, tzinfo
+from datetime import datetime
 from collections import namedtuple
 from dateutil.parser import parse
+from dateutil.tz import tzutc
 from tzlocal import get_localzone
 
 import requests
 
-class GMT2(tzinfo):
-    def utcoffset(self, dt):
-        return timedelta(hours=2) + self.dst(dt)
-    def dst(self, dt):
-        d = datetime(dt.year, 4, 1)
-        self.dston = d - timedelta(days=d.weekday() + 1)
-        d = datetime(dt.year, 11, 1)
-        self.dstoff = d - timedelta(days=d.weekday() + 1)
-        if self.dston <=  dt.replace(tzinfo=None) < self.dstoff:
-            return timedelta(hours=1)
-        else:
-            return timedelta(0)
-    def tzname(self,dt):
-        return "GMT +2"
+# obs-api times are UTC, so compare them against UTC
+UTC = tzutc()
 
 
 url = "http://camonitor.uct.ac.za/obs-api/event/"
@@ -28,14 +17,14 @@ myResponse = requests.get(url)
 
 if (myResponse.ok):
     x = json.loads(myResponse.content, object_hook=lambda d: namedtuple('X', d.keys())(*d.values()))
-    now = datetime.now(GMT2())
-    print("Now: "+ now.astimezone(get_localzone()))
+    now = datetime.now(UTC)
+    print("Now: "+ str(now.astimezone(get_localzone())))
 
     for line in x:
         if line.ocSeries is not None:
             start = parse(line.start.dateTime + 'Z')
             
-            end = parse(line.start.dateTime + 'Z')
+            end = parse(line.end.dateTime + 'Z')
             
             if start < now < end:
                 print "scheduled event"
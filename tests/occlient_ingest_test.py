@@ -0,0 +1,156 @@
+"""
+Runs the resumable chunked ingest, the streaming ingest and the idempotent
+create_series of OCHTTPClient against the local Opencast stand-in.
+
+    python tests/occlient_ingest_test.py
+
+Every check prints OK or FAILED; the exit status is the number of failures.
+"""
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from opencast_standin import StandinServer
+from galicaster.opencast.client import OCHTTPClient, RetryPolicy, INGEST_STATE_FILE
+
+CHUNK_SIZE = 64 * 1024
+TRACK_CHUNKS = 5
+
+
+class Element(object):
+    def __init__(self, path, flavor):
+        self.path = path
+        self.flavor = flavor
+
+    def getURI(self):
+        return self.path
+
+    def getFlavor(self):
+        return self.flavor
+
+
+class Mediapackage(object):
+    """ The parts of a repository mediapackage the client uses """
+    def __init__(self, folder):
+        self.folder = folder
+        self.tracks = [Element(self.write('presenter.mp4', CHUNK_SIZE * TRACK_CHUNKS - 100), 'presenter/source')]
+        self.catalogs = [Element(self.write('episode.xml', 300), 'dublincore/episode')]
+        self.write('manifest.xml', 200)
+
+    def write(self, name, size):
+        path = os.path.join(self.folder, name)
+        with open(path, 'wb') as f:
+            f.write(os.urandom(size))
+        return path
+
+    def getIdentifier(self):
+        return 'standin-mp'
+
+    def getURI(self):
+        return self.folder
+
+    def getTracks(self):
+        return self.tracks
+
+    def getCatalogs(self):
+        return self.catalogs
+
+    def getAttachments(self):
+        return []
+
+    def getElements(self):
+        return self.tracks + self.catalogs
+
+
+def client(server):
+    return OCHTTPClient(server.url, 'admin', 'opencast', 'standin', '127.0.0.1', timeout=10,
+                        chunk_size=CHUNK_SIZE, state_outbox=False, reuse_connections=False,
+                        retry_policy=RetryPolicy(base_delay=0.01, max_delay=0.05))
+
+
+def check(name, ok, detail=''):
+    print("{:>40}: {} {}".format(name, 'OK' if ok else 'FAILED', detail))
+    return 0 if ok else 1
+
+
+def test_chunked_resume(server, mp):
+    """ Break the upload after two chunks, then ingest again: only the missing chunks are sent """
+    oc = client(server)
+    state_path = os.path.join(mp.getURI(), INGEST_STATE_FILE)
+
+    def interrupt(mp_id, sent, total):
+        if sent >= 2 * CHUNK_SIZE and sent < total:
+            server.failures = 1000
+
+    chunks = server.stats.chunks
+    try:
+        oc.ingest_chunked(mp, progress=interrupt)
+        interrupted = False
+    except Exception:
+        interrupted = True
+    server.failures = 0
+    sent_first = server.stats.chunks - chunks
+    saved = os.path.exists(state_path)
+
+    result = oc.ingest_chunked(mp)
+    sent_total = server.stats.chunks - chunks
+    return (check('chunked ingest interrupted', interrupted and saved,
+                  '({} chunks sent)'.format(sent_first)) +
+            check('chunked ingest resumed', 'workflow' in result or 'mediapackage' in result) +
+            check('no chunk sent twice', sent_total == TRACK_CHUNKS, '({} chunks)'.format(sent_total)) +
+            check('resume state removed', not os.path.exists(state_path)))
+
+
+def test_chunked_lost_job(server, mp):
+    """ The server forgets the upload job after the first chunk: the track is sent again in a new job """
+    oc = client(server)
+    cleared = []
+
+    def forget_job(mp_id, sent, total):
+        if sent >= CHUNK_SIZE and not cleared:
+            server.jobs.clear()
+            cleared.append(sent)
+
+    chunks = server.stats.chunks
+    result = oc.ingest_chunked(mp, progress=forget_job)
+    sent = server.stats.chunks - chunks
+    return check('chunked ingest with a lost job', 'mediapackage' in result and sent == 1 + TRACK_CHUNKS,
+                 '({} chunks)'.format(sent))
+
+
+def test_stream(server, mp):
+    oc = client(server)
+    zips = len(server.stats.zips)
+    oc.set_ingest_mode(streaming=True)
+    oc.ingest_mediapackage(mp)
+    names = server.stats.zips[-1] if len(server.stats.zips) > zips else []
+    return check('streamed zip is valid', sorted(names) == ['episode.xml', 'manifest.xml', 'presenter.mp4'],
+                 str(names))
+
+
+def test_create_series(server):
+    """ The series is created but the response is lost: the retry finds it instead of creating another """
+    oc = client(server)
+    del server.series[:]
+    server.lost_responses = 1
+    first = oc.create_series('[]', '[]', user_id='01234567')
+    second = oc.create_series('[]', '[]', user_id='01234567')
+    return (check('create_series retried', first is not None and 'standin-series-0' in first, str(first)) +
+            check('one series created', len(server.series) == 1, str(server.series)) +
+            check('existing series returned', second is not None and 'standin-series-0' in second))
+
+
+if __name__ == '__main__':
+    server = StandinServer(0).start()
+    folder = tempfile.mkdtemp()
+    try:
+        mp = Mediapackage(folder)
+        failed = (test_chunked_resume(server, mp) + test_chunked_lost_job(server, mp) +
+                  test_stream(server, mp) + test_create_series(server))
+    finally:
+        shutil.rmtree(folder)
+        server.shutdown()
+    sys.exit(failed)
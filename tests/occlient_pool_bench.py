@@ -0,0 +1,46 @@
+"""
+Per-call latency of OCHTTPClient with and without cURL handle reuse,
+against the local Opencast stand-in.
+
+    python tests/occlient_pool_bench.py [calls] [latency ms] [connect latency ms]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from opencast_standin import StandinServer
+from galicaster.opencast.client import OCHTTPClient
+
+
+def measure(client, name, call, calls):
+    call() # warm up
+    start = time.time()
+    for i in range(calls):
+        call()
+    return (time.time() - start) / calls
+
+
+if __name__ == '__main__':
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    latency = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.002
+    connect_latency = float(sys.argv[3]) / 1000 if len(sys.argv) > 3 else 0.020
+
+    server = StandinServer(0, latency, connect_latency).start()
+    print("{} calls, {:.0f} ms per request, {:.0f} ms per new connection".format(
+        calls, latency * 1000, connect_latency * 1000))
+
+    for reuse in (False, True):
+        client = OCHTTPClient(server.url, 'admin', 'opencast', 'standin', '127.0.0.1',
+                              timeout=10, reuse_connections=reuse, state_outbox=False)
+        before = server.stats.connections
+        results = [
+            ('setstate', measure(client, 'setstate', lambda: client.setstate('idle'), calls)),
+            ('get_user_details', measure(client, 'get_user_details', lambda: client.get_user_details('01234567'), calls)),
+            ('get_personal_series', measure(client, 'get_personal_series',
+                                            lambda: client.get_personal_series('01234567', ''), calls)),
+        ]
+        print("reuse_connections={} ({} connections opened)".format(reuse, server.stats.connections - before))
+        for name, seconds in results:
+            print("  {:>20}: {:7.2f} ms/call".format(name, seconds * 1000))
@@ -0,0 +1,205 @@
+"""
+Minimal local stand-in for the Opencast endpoints used by OCHTTPClient,
+for benchmarks and for trying the client without a real server.
+
+    python tests/opencast_standin.py [port] [latency ms] [connect latency ms]
+
+Every request is answered after `latency` ms; every new connection waits
+`connect latency` ms first, standing in for the TCP/TLS handshake to a
+remote server. Requests without an Authorization header get a Digest
+challenge, like Opencast does. Upload jobs (upload/newjob, upload/job/{id})
+keep their received chunks in memory so chunked ingests can be resumed;
+ingest/addZippedMediaPackage checks that the posted zip is valid. Set
+`failures` on the server to answer that many of the next requests with 503,
+or `lost_responses` to carry out that many of the next JSON requests (e.g.
+creating a series) but answer them with 503, as if the response was lost.
+"""
+import io
+import json
+import re
+import socket
+import sys
+import threading
+import time
+import zipfile
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+
+class Stats(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.requests = 0
+        self.challenges = 0
+        self.chunks = 0
+        self.bytes = 0
+        self.zips = []
+
+    def add(self, name):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # send each response in one write, avoiding Nagle / delayed ACK stalls on kept-alive connections
+    wbufsize = -1
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.server.stats.add('connections')
+        time.sleep(self.server.connect_latency)
+
+    def reply(self, code, body=b'', content_type='application/json', headers=None):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for h, v in (headers or {}).items():
+            self.send_header(h, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() != 'chunked':
+            length = int(self.headers.get('Content-Length') or 0)
+            return self.rfile.read(length) if length else b''
+        data = []
+        while True:
+            size = int(self.rfile.readline().split(b';')[0], 16)
+            if not size:
+                self.rfile.readline()
+                return b''.join(data)
+            data.append(self.rfile.read(size))
+            self.rfile.readline()
+
+    def handle_request(self, method):
+        time.sleep(self.server.latency)
+        expect = self.headers.get('Expect', '').lower() == '100-continue'
+        if not self.headers.get('Authorization'):
+            self.server.stats.add('challenges')
+            if expect:
+                # the body was never sent
+                self.close_connection = 1
+            else:
+                self.read_body()
+            return self.reply(401, b'', 'text/html', {
+                'WWW-Authenticate': 'Digest realm="Opencast", qop="auth", nonce="%d", opaque="0"' % int(time.time())})
+        if expect:
+            self.wfile.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+            self.wfile.flush()
+        data = self.read_body()
+
+        self.server.stats.add('requests')
+        if self.server.take_failure():
+            return self.reply(503, b'<title>Service Unavailable</title>', 'text/html')
+        path = self.path.split('?')[0]
+        if re.match(r'^/users/[^/]+\.json$', path):
+            user = path.split('/')[-1][:-5]
+            body = {'user': {'name': 'Stand-in %s' % user, 'email': '%s@example.com' % user, 'username': user}}
+        elif path.startswith('/api/series'):
+            if method == 'POST':
+                time.sleep(self.server.latency)
+                self.server.series.append('standin-series-%d' % len(self.server.series))
+                body = {'identifier': self.server.series[-1]}
+            else:
+                body = [{'identifier': s, 'title': 'Personal Series (Stand-in)'} for s in self.server.series[:1]]
+        elif path.startswith('/capture-admin/'):
+            return self.reply(200, b'', 'text/plain')
+        elif path.startswith('/info/me.json'):
+            body = {'username': 'admin'}
+        elif path == '/ingest/addZippedMediaPackage':
+            start = data.index(b'\r\n\r\n', data.index(b'filename=')) + 4
+            archive = zipfile.ZipFile(io.BytesIO(data[start:data.rindex(b'\r\n--')]))
+            if archive.testzip() is not None:
+                return self.reply(400, b'<title>Bad zip</title>', 'text/html')
+            self.server.stats.zips.append(archive.namelist())
+            return self.reply(200, b'<workflow id="standin"/>', 'text/xml')
+        elif path.startswith('/ingest/'):
+            return self.reply(200, b'<mediapackage id="standin"/>', 'text/xml')
+        elif path == '/upload/newjob':
+            form = dict(kv.split('=', 1) for kv in data.decode('utf-8').split('&') if '=' in kv)
+            chunks = max(-(-int(form.get('filesize', 0)) // int(form.get('chunksize', 1))), 1)
+            return self.reply(200, self.server.new_job(chunks).encode('ascii'), 'text/plain')
+        elif re.match(r'^/upload/job/[^/]+\.json$', path):
+            job = self.server.jobs.get(path.split('/')[-1][:-5])
+            if job is None:
+                return self.reply(404, b'<title>Not found</title>', 'text/html')
+            body = {'uploadjob': {'id': job['id'], 'state': 'COMPLETE' if job['complete'] else 'INPROGRESS',
+                                  'currentchunk': {'number': job['chunk']},
+                                  'payload': {'url': 'http://standin/files/%s' % job['id'] if job['complete'] else None}}}
+        elif path.startswith('/upload/job/'):
+            job = self.server.jobs.get(path.split('/')[-1])
+            if job is None:
+                return self.reply(404, b'<title>Not found</title>', 'text/html')
+            job['chunk'] += 1
+            job['complete'] = job['chunk'] + 1 >= job['chunks']
+            self.server.stats.add('chunks')
+            with self.server.stats.lock:
+                self.server.stats.bytes += len(data)
+            return self.reply(200, b'', 'text/plain')
+        else:
+            return self.reply(404, b'<title>Not found</title>', 'text/html')
+        if self.server.take_failure('lost_responses'):
+            return self.reply(503, b'<title>Service Unavailable</title>', 'text/html')
+        self.reply(200, json.dumps(body).encode('utf-8'))
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StandinServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=0, latency=0.0, connect_latency=0.0):
+        HTTPServer.__init__(self, ('127.0.0.1', port), Handler)
+        self.latency = latency
+        self.connect_latency = connect_latency
+        self.stats = Stats()
+        self.jobs = {}
+        self.failures = 0
+        self.lost_responses = 0
+        self.series = []
+
+    def take_failure(self, name='failures'):
+        with self.stats.lock:
+            if getattr(self, name) > 0:
+                setattr(self, name, getattr(self, name) - 1)
+                return True
+        return False
+
+    def new_job(self, chunks):
+        job_id = 'job-%d' % len(self.jobs)
+        self.jobs[job_id] = {'id': job_id, 'chunk': -1, 'chunks': chunks, 'complete': False}
+        return job_id
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d/' % self.server_address[1]
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+        return self
+
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8081
+    latency = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.0
+    connect_latency = float(sys.argv[3]) / 1000 if len(sys.argv) > 3 else 0.0
+    server = StandinServer(port, latency, connect_latency)
+    print("Opencast stand-in on %s" % server.url)
+    server.serve_forever()
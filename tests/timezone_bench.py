@@ -0,0 +1,61 @@
+"""
+Per-booking comparison cost of the old GMT2 tzinfo + dateutil parsing
+against the UTC comparisons, ZoneTable and parse_utc used by the obs plugin.
+
+Run from a Galicaster checkout with obs.py installed as a plugin:
+
+    python tests/timezone_bench.py [rounds]
+"""
+import sys
+import timeit
+
+from datetime import timedelta, datetime, tzinfo
+from dateutil.parser import parse
+
+from galicaster.plugins.obs import UTC, ZoneTable, parse_utc
+
+
+class GMT2(tzinfo):
+    """ The tzinfo the obs plugin used before the transition table """
+    def utcoffset(self, dt):
+        return timedelta(hours=2) + self.dst(dt)
+    def dst(self, dt):
+        d = datetime(dt.year, 4, 1)
+        self.dston = d - timedelta(days=d.weekday() + 1)
+        d = datetime(dt.year, 11, 1)
+        self.dstoff = d - timedelta(days=d.weekday() + 1)
+        if self.dston <=  dt.replace(tzinfo=None) < self.dstoff:
+            return timedelta(hours=1)
+        else:
+            return timedelta(0)
+    def tzname(self,dt):
+        return "GMT +2"
+
+
+VALUE = '2018-05-22T08:00:00.0000000'
+
+
+def report(name, func, rounds):
+    seconds = min(timeit.repeat(func, number=rounds, repeat=3)) / rounds
+    print("{:>36}: {:8.3f} us".format(name, seconds * 1e6))
+
+
+if __name__ == '__main__':
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    gmt2 = GMT2()
+    old_now = datetime.now(gmt2)
+    new_now = datetime.now(UTC)
+    start_old = parse(VALUE + 'Z')
+    end_old = start_old + timedelta(hours=1)
+    start_new = parse_utc(VALUE)
+    end_new = start_new + timedelta(hours=1)
+    zone = ZoneTable('Africa/Johannesburg')
+    naive = datetime(2018, 5, 22, 10, 0)
+
+    report("parse (dateutil)", lambda: parse(VALUE + 'Z'), rounds // 10)
+    report("parse_utc", lambda: parse_utc(VALUE), rounds)
+    report("compare start < now < end (GMT2)", lambda: start_old < old_now < end_old, rounds)
+    report("compare start < now < end (UTC)", lambda: start_new < new_now < end_new, rounds)
+    report("utcoffset (GMT2)", lambda: gmt2.utcoffset(naive), rounds)
+    report("utcoffset (ZoneTable)", lambda: zone.utcoffset(naive), rounds)